@@ -0,0 +1,379 @@
+#!/usr/bin/python
+"""
+Benchmarks for wpVitalsTender, run offline against synthetic pages shaped like the Vital articles lists.
+API calls are answered by SyntheticApi, a stand-in transport for the Wikipedia API with optional latency,
+or replayed from a recording of real responses made with RecordingTransport.
+"""
+
+
+import re
+import json
+import time
+import random
+import zlib
+import argparse
+import threading
+import tracemalloc
+import wpVitalsTender as wpvt
+
+
+# Listings per page, roughly as on Wikipedia
+LEVEL_SIZES = {1: 10, 2: 100, 3: 1000, 4: 1500}
+# Pages and listings per page of each run that can be benchmarked, "all" being main()'s full sweep
+SCENARIOS = {"1": (1, LEVEL_SIZES[1]), "2": (1, LEVEL_SIZES[2]), "3": (1, LEVEL_SIZES[3]),
+             "all": (len(wpvt.all_articles), LEVEL_SIZES[4])}
+CLASSES = ["FA", "A", "GA", "B", "C", "Start", "Stub"]
+REDIRECT_SUFFIX = " (redirect)"
+
+
+def legacy_parse_article(content):
+    """parse_article as it was before the single pass scanner, for comparison."""
+    article_listing_regex = re.compile(r'''
+        [*#]\s*                                         # line starts with a bullet or a number
+        (?P<assessment>\{\{[Ii]con\|\w+\}\})            # assessment should always be first
+        (?P<history>\s*\{\{[Ii]con\|\w+\}\})*           # option of multiple icons for FFA, or DGA
+        \s*
+        \'*\[\[(?P<title>[^#<>\[\]]+)\]\]               # actual title is a wikilink
+    ''', re.VERBOSE)
+    results = []
+    for l in article_listing_regex.finditer(content):
+        article = {
+            "title": l.group("title").split("|")[0],
+            "assessment": l.group("assessment").split("|")[-1][:-2],
+            "history": None,
+        }
+        if l.group("history"):
+            article["history"] = l.group("history").split("|")[-1][:-2]
+        results.append(article)
+    return results
+
+
+def legacy_find_mismatches(listings, assessments, accuracy=.01):
+    """find_mismatches as it was before MismatchEngine, for comparison."""
+    mismatches = []
+    for l in listings:
+        if l["title"] in assessments:
+            article_assessments = assessments[l["title"]]
+            processed_assessments = list(map(str.lower, filter(lambda c: c != '', article_assessments)))
+            if len(processed_assessments) != 0:
+                assessment_ratio = processed_assessments.count(l["assessment"].lower()) / len(processed_assessments)
+                if assessment_ratio < accuracy:
+                    mismatches.append({"title": l["title"], "listed_as": l["assessment"],
+                                       "current": article_assessments})
+        else:
+            mismatches.append({"title": l["title"], "listed_as": l["assessment"], "current": None})
+    return mismatches
+
+
+def synthetic_page(num_listings, seed=0, prefix="Article", redirect_ratio=.03):
+    """Wikitext of a Vital articles style page with num_listings listings in sections and subsections.
+    About redirect_ratio of the listings link to a title that SyntheticApi treats as a redirect."""
+    rng = random.Random(seed)
+    lines = ["{{Wikipedia:Vital articles/Level/4/Nav bar}}",
+             "This list is tailored to the English-language [[Wikipedia]]. See the [[Wikipedia talk:Vital articles|"
+             "talk page]] for {{tl|discussion}}.",
+             "==Current total: {}==".format(num_listings)]
+    section_size = max(1, num_listings // 10)
+    for n in range(num_listings):
+        if n % section_size == 0:
+            lines.append("== Section {} ({} articles) ==".format(n // section_size, section_size))
+        if n % 25 == 0:
+            lines.append("=== Subsection {} (25 articles) ===".format(n // 25))
+            lines.append("{{columns-list|colwidth=30em|")
+        history = rng.choice(["", "", "", "", " {{Icon|DGA}}", " {{Icon|FFA}} {{Icon|DGA}}"])
+        title = "{} {}".format(prefix, n)
+        if rng.random() < redirect_ratio:
+            title += REDIRECT_SUFFIX
+        link = "[[{}]]".format(title) if rng.random() < .8 else "[[{}|{}, shown differently]]".format(title, title)
+        # most listings are up to date
+        listed = synthetic_class(title) if rng.random() < .9 else rng.choice(CLASSES)
+        lines.append("{} {{{{Icon|{}}}}}{} {}".format(rng.choice(["#", "*", "**"]), listed, history, link))
+        if n % 25 == 24:
+            lines.append("}}")
+    lines.append("[[Category:Wikipedia level-4 vital articles|*]]")
+    return "\n".join(lines)
+
+
+def synthetic_class(title):
+    """The class most WikiProjects give a title in SyntheticApi, the same on every run."""
+    if title.endswith(REDIRECT_SUFFIX):
+        title = title[:-len(REDIRECT_SUFFIX)]
+    return CLASSES[zlib.crc32(title.encode()) % len(CLASSES)]
+
+
+def synthetic_classes(title):
+    """The WikiProject classes SyntheticApi gives a title, the same on every run."""
+    rng = random.Random(zlib.crc32(title.encode()))
+    if rng.random() < .02:
+        return []
+    main = synthetic_class(title)
+    return [main if rng.random() < .85 else rng.choice(CLASSES + [""]) for _ in range(rng.randint(1, 6))]
+
+
+class Response:
+    """Just enough of a requests.Response for ApiClient."""
+    def __init__(self, content, headers=None):
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class SyntheticApi:
+    """Transport answering the queries wpVitalsTender makes, as the Wikipedia API would, from generated data.
+    Page content comes from pages, a dict of title to wikitext. Titles ending in REDIRECT_SUFFIX redirect to
+    the title without it, and assessments are returned up to palimit at a time (10 unless palimit=max, then
+    500), with "continue", as the real API does. Pages are not split across responses, unlike the real API.
+    Counts calls and bytes sent, and sleeps latency seconds on every call.
+    """
+    def __init__(self, pages, latency=0.0, assessments_per_response=10):
+        self.pages = pages
+        self.latency = latency
+        self.assessments_per_response = assessments_per_response
+        self.calls = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, params, headers=None, timeout=None):
+        if self.latency:
+            time.sleep(self.latency)
+        content = json.dumps(self.respond(params)).encode()
+        with self._lock:
+            self.calls += 1
+            self.bytes += len(content)
+        return Response(content)
+
+    def respond(self, params):
+        titles = params["titles"].split("|")
+        prop = params.get("prop")
+        if params.get("generator") == "links":
+            return self.respond_links(params, titles[0])
+        if prop == "revisions":
+            return {"batchcomplete": "", "query": {"pages": {"1": {"title": titles[0], "ns": 4, "revisions": [
+                {"contentformat": "text/x-wiki", "contentmodel": "wikitext", "*": self.pages[titles[0]]}]}}}}
+        query = {}
+        if "redirects" in params:
+            redirects = [{"from": t, "to": t[:-len(REDIRECT_SUFFIX)]} for t in titles if t.endswith(REDIRECT_SUFFIX)]
+            if redirects:
+                query["redirects"] = redirects
+            titles = [t[:-len(REDIRECT_SUFFIX)] if t.endswith(REDIRECT_SUFFIX) else t for t in titles]
+        query["pages"] = {str(i): {"pageid": i, "ns": 0, "title": t} for i, t in enumerate(titles)}
+        if prop == "info":
+            for page in query["pages"].values():
+                page["lastrevid"] = zlib.crc32(page["title"].encode())
+        response = {"query": query}
+        if prop != "pageassessments":
+            response["batchcomplete"] = ""
+            return response
+        # palimit counts assessments, not pages, and each page has one per project
+        limit = 500 if params.get("palimit") == "max" else self.assessments_per_response
+        end = int(params.get("pacontinue", 0))
+        returned = 0
+        while end < len(titles):
+            classes = synthetic_classes(titles[end])
+            if returned and returned + len(classes) > limit:
+                break
+            returned += len(classes)
+            if classes:
+                query["pages"][str(end)]["pageassessments"] = {
+                    "Project {}".format(j): {"class": c, "importance": "Mid"} for j, c in enumerate(classes)}
+            end += 1
+        if end < len(titles):
+            response["continue"] = {"pacontinue": str(end), "continue": "||"}
+        else:
+            response["batchcomplete"] = ""
+        return response
+
+    def respond_links(self, params, title, links_per_response=500):
+        """Answers a generator=links query as a query for the titles of a batch of the page's links."""
+        links = [l["title"] for l in wpvt.parse_article(self.pages[title])]
+        start = int(params.get("gplcontinue", 0))
+        batch = links[start:start + links_per_response]
+        response = self.respond({k: v for k, v in params.items() if not k.startswith(("generator", "gpl"))} |
+                                {"titles": "|".join(batch)})
+        if "continue" in response:
+            response["continue"]["gplcontinue"] = str(start)
+        elif start + links_per_response < len(links):
+            response["continue"] = {"gplcontinue": str(start + links_per_response), "continue": "gplcontinue||"}
+        return response
+
+
+class RecordingTransport:
+    """Wraps a transport, such as a requests.Session, saving every response to a JSON lines file
+    that ReplayTransport can answer from later."""
+    def __init__(self, transport, path):
+        self.transport = transport
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+
+    def get(self, url, params, headers=None, timeout=None):
+        resp = self.transport.get(url, params, headers=headers, timeout=timeout)
+        with self._lock:
+            self._file.write(json.dumps({"params": _replay_key(params), "response": resp.json()}) + "\n")
+        return resp
+
+    def close(self):
+        self._file.close()
+
+
+class ReplayTransport(SyntheticApi):
+    """Answers queries from a file written by RecordingTransport, with the same counting and latency
+    as SyntheticApi."""
+    def __init__(self, path, latency=0.0):
+        super().__init__({}, latency)
+        self.recorded = {}
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                self.recorded[record["params"]] = record["response"]
+
+    def respond(self, params):
+        return self.recorded[_replay_key(params)]
+
+
+def _replay_key(params):
+    return json.dumps({k: v for k, v in params.items() if k != "maxlag"}, sort_keys=True)
+
+
+def timed(func, *args, repeat=15):
+    """Returns the best wall time of repeat calls to func, and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_parse(pages=14, listings_per_page=LEVEL_SIZES[4]):
+    """Compares the old regex parse with parse_article, iter_listings and SectionIndex over a Level 4 sized sweep."""
+    contents = [synthetic_page(listings_per_page, seed=i) for i in range(pages)]
+    parsers = [
+        ("legacy regex", legacy_parse_article),
+        ("parse_article", wpvt.parse_article),
+        ("iter_listings", lambda c: list(wpvt.iter_listings(c))),
+        ("SectionIndex", lambda c: wpvt.SectionIndex(c).listings),
+    ]
+    print("Parsing {} pages of {} listings, {} KB of wikitext".format(
+        pages, listings_per_page, sum(len(c) for c in contents) // 1024))
+    for name, parser in parsers:
+        elapsed, results = timed(lambda: [parser(c) for c in contents])
+        print("  {:<15} {:8.1f} ms  {} listings".format(name, elapsed * 1000, sum(len(r) for r in results)))
+
+
+def benchmark_mismatches(pages=14, listings_per_page=LEVEL_SIZES[4]):
+    """Compares the old find_mismatches with MismatchEngine, with and without NumPy, over a Level 4 sized sweep."""
+    listings = [l for i in range(pages) for l in wpvt.iter_listings(synthetic_page(listings_per_page, seed=i))]
+    assessments = {l.title: synthetic_classes(l.title) for l in listings}
+    assessments = {title: classes for title, classes in assessments.items() if classes}
+    dicts = [l.as_dict() for l in listings]
+    finders = [("legacy", lambda: legacy_find_mismatches(dicts, assessments))]
+    if wpvt.numpy is not None:
+        finders.append(("engine, NumPy", lambda: wpvt.find_mismatches(listings, assessments)))
+    finders.append(("engine, Python", lambda: _without_numpy(wpvt.find_mismatches, listings, assessments)))
+    finders.append(("engine, 4 accuracies", lambda: wpvt.MismatchEngine(listings, assessments)
+                    .mismatches_by_accuracy([.01, .25, .5, .75])))
+    print("Finding mismatches in {} listings".format(len(listings)))
+    for name, finder in finders:
+        elapsed, results = timed(finder)
+        print("  {:<20} {:8.1f} ms  {} mismatches".format(
+            name, elapsed * 1000, len(results[.01]) if isinstance(results, dict) else len(results)))
+
+
+def _without_numpy(func, *args):
+    numpy, wpvt.numpy = wpvt.numpy, None
+    try:
+        return func(*args)
+    finally:
+        wpvt.numpy = numpy
+
+
+def measure(name, func, transport):
+    """Runs func once for wall time and API use, and again under tracemalloc for peak memory."""
+    calls, sent = transport.calls, transport.bytes
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    result = {"name": name, "seconds": elapsed, "calls": transport.calls - calls, "bytes": transport.bytes - sent}
+    tracemalloc.start()
+    func()
+    result["peak_memory"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+def benchmark_pipeline(scenario="all", latency=0.0, workers=wpvt.DEFAULT_WORKERS, recording=None):
+    """Times parse_article, batch_query, find_redirects and article_list_assessment_check over a scenario's
+    pages, answering API calls from SyntheticApi, or from a recording of real responses.
+
+    :param scenario: key of SCENARIOS
+    :param latency: seconds added to every API call
+    :param workers: ApiClient workers
+    :param recording: optional file written by RecordingTransport to replay instead of generated data
+    :return: list of measurements, dicts of name, seconds, calls, bytes and peak_memory
+    """
+    num_pages, listings_per_page = SCENARIOS[scenario]
+    titles = wpvt.all_articles[:num_pages] if scenario == "all" else ["Wikipedia:Vital articles/Level/" + scenario]
+    if recording:
+        transport = ReplayTransport(recording, latency)
+    else:
+        transport = SyntheticApi({t: synthetic_page(listings_per_page, seed=i, prefix="Page {} article".format(i))
+                                  for i, t in enumerate(titles)}, latency)
+    client = wpvt.ApiClient(transport=transport, workers=workers, max_rps=None, maxlag=None)
+    contents = [wpvt.get_content(t, client=client) for t in titles]
+    listed_titles = [l["title"] for c in contents for l in wpvt.parse_article(c)]
+    results = [
+        measure("parse_article", lambda: [wpvt.parse_article(c) for c in contents], transport),
+        measure("batch_query", lambda: wpvt.batch_query({"prop": "pageassessments", "palimit": "max"}, listed_titles,
+                                                        client=client), transport),
+        measure("find_redirects", lambda: wpvt.find_redirects(listed_titles, client=client), transport),
+        measure("article_list_assessment_check", lambda: [
+            wpvt.article_list_assessment_check(t, client=client, log=lambda line: None) for t in titles], transport),
+    ]
+    if not recording:
+        results.append(measure("article_list_assessment_check --links", lambda: [
+            wpvt.article_list_assessment_check(t, client=client, log=lambda line: None, links=True)
+            for t in titles], transport))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for wpVitalsTender.")
+    parser.add_argument("scenarios", nargs="*", default=["all"],
+                        help="Levels to run the pipeline benchmark on, out of {}. \"all\" is the full Level 4 "
+                             "sweep".format(", ".join(SCENARIOS)))
+    parser.add_argument("--latency", help="Seconds of latency added to every API call", type=float, default=0.0)
+    parser.add_argument("-w", "--workers", help="Number of API requests in flight at once", type=int,
+                        default=wpvt.DEFAULT_WORKERS)
+    parser.add_argument("--replay", metavar="FILE", help="Replay API responses recorded by RecordingTransport")
+    parser.add_argument("--parse", action="store_true", help="Only compare parsers")
+    parser.add_argument("--pages", help="Number of pages to parse", type=int, default=len(wpvt.all_articles))
+    parser.add_argument("--listings", help="Listings per page to parse", type=int, default=LEVEL_SIZES[4])
+    parser.add_argument("--json", metavar="FILE", help="Also write the pipeline results to FILE as JSON")
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error("unknown scenario {}, choose from {}".format(scenario, ", ".join(SCENARIOS)))
+
+    benchmark_parse(args.pages, args.listings)
+    benchmark_mismatches(args.pages, args.listings)
+    if args.parse:
+        return
+    results = {}
+    for scenario in args.scenarios:
+        num_pages, listings_per_page = SCENARIOS[scenario]
+        print("Level {}: {} pages of {} listings, {} s latency, {} workers".format(
+            scenario, num_pages, listings_per_page, args.latency, args.workers))
+        results[scenario] = benchmark_pipeline(scenario, args.latency, args.workers, args.replay)
+        for r in results[scenario]:
+            print("  {name:<30} {seconds:8.3f} s {calls:6} calls {kb:8} KB {peak:8} KB peak memory".format(
+                kb=r["bytes"] // 1024, peak=r["peak_memory"] // 1024, **r))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 #!/usr/bin/python
+import os
+import json
+import pickle
+import tempfile
 import unittest
 import unittest.mock
 import wpVitalsTender as wpvt
-import json
 
 
 def mock_requests_get(*args, **kwargs):
@@ -18,6 +21,10 @@ def mock_requests_get(*args, **kwargs):
     if "redirects" in args[1] and args[1]["titles"] == "Buildings|Bricks|Houses|WW2|WW1|Cup":
         return MockResponse('test_docs/test_Redirects.json', 200)
     if "prop" in args[1]:
+        if args[1]["prop"] == "pageassessments" and "redirects" in args[1] and \
+                args[1]["titles"] == "Earth|Life|Human|History of the world|Culture|Language|The arts|Science|" \
+                                     "Technology|Mathematics":
+            return MockResponse('test_docs/test_Level1_assessments.json', 200)
         if args[1]["prop"] == "revisions" and args[1]["titles"] == "Wikipedia:Vital articles/Level/1":
             return MockResponse('test_docs/test_WikipediaLevel1_content.json', 200)
         if args[1]["prop"] == "pageassessments" and args[1]["titles"] == "Mummy Cave":
@@ -39,9 +46,52 @@ def mock_requests_get(*args, **kwargs):
     return MockResponse("", 404)
 
 
+def json_response(data, **attrs):
+    """Stand-in for a response whose json() returns data, for API answers made up in a test."""
+    return unittest.mock.Mock(**{"json.return_value": data}, **attrs)
+
+
+def mock_transport(get):
+    """Stand-in for the requests session, answering with get and recording its calls in transport.get."""
+    return unittest.mock.Mock(get=unittest.mock.Mock(side_effect=get))
+
+
+class MockTransport:
+    """Picklable stand-in for the requests session, for clients made in sweep processes."""
+    def get(self, *args, **kwargs):
+        return mock_requests_get(*args, **kwargs)
+
+
+class SectionedPageTransport:
+    """Picklable stand-in for the requests session serving a page of several sections, SECTIONED_PAGE, and
+    assessments for any titles, every third of them C class and the rest B."""
+    def get(self, url, params, headers=None, timeout=None):
+        titles = params["titles"].split("|")
+        if params["prop"] == "revisions":
+            return json_response({"batchcomplete": "", "query": {"pages": {"1": {"title": titles[0], "revisions": [
+                {"*": SECTIONED_PAGE}]}}}})
+        return json_response({"batchcomplete": "", "query": {"pages": {
+            str(i): {"title": t, "pageassessments": {"Project": {"class": "C" if int(t.split()[-1]) % 3 else "B"}}}
+            for i, t in enumerate(titles)}}})
+
+
+SECTIONED_PAGE = "Lead\n" + "".join(
+    "== Part {} ({} articles) ==\n".format(part, 5) +
+    "".join("# {{{{Icon|B}}}} [[Article {}]]\n".format(part * 10 + i) for i in range(5))
+    for part in range(1, 4))
+
+
 class TestWpVitalsTender(unittest.TestCase):
-    @unittest.mock.patch('requests.get', side_effect=mock_requests_get)
-    def test_get_content(self, mock_get):
+    def setUp(self):
+        self.mock_get = unittest.mock.Mock(side_effect=mock_requests_get)
+        self.transport = unittest.mock.Mock(get=self.mock_get)
+        self.previous_client = wpvt.set_client(wpvt.ApiClient(transport=self.transport, max_rps=None))
+
+    def tearDown(self):
+        wpvt.set_client(self.previous_client)
+
+    def test_get_content(self):
+        mock_get = self.mock_get
         article_title = "Wikipedia:Vital articles/Level/1"
         result = wpvt.get_content(article_title)
 
@@ -54,7 +104,505 @@ class TestWpVitalsTender(unittest.TestCase):
             "prop": "revisions",
             "rvprop": "content",
             "format": "json",
-        }, headers={"User-Agent": wpvt.USER_AGENT})
+            "maxlag": wpvt.DEFAULT_MAXLAG,
+        }, headers={"User-Agent": wpvt.USER_AGENT, "Accept-Encoding": "gzip, deflate"}, timeout=wpvt.DEFAULT_TIMEOUT)
+
+    def test_client_override(self):
+        other_get = unittest.mock.Mock(side_effect=mock_requests_get)
+        client = wpvt.ApiClient(api_url="https://test.example/w/api.php", user_agent="tester",
+                                transport=unittest.mock.Mock(get=other_get))
+        result = wpvt.get_content("Wikipedia:Vital articles/Level/1", client=client)
+
+        self.assertIn("Earth", result)
+        self.mock_get.assert_not_called()
+        self.assertEqual(other_get.call_args[0][0], "https://test.example/w/api.php")
+        self.assertEqual(other_get.call_args[1]["headers"]["User-Agent"], "tester")
+
+    def test_default_transport_is_pooled_session(self):
+        client = wpvt.ApiClient(pool_size=4)
+        self.assertIsInstance(client.transport, wpvt.requests.Session)
+        self.assertEqual(client.transport.get_adapter(wpvt.API_URL)._pool_maxsize, 4)
+        client.close()
+
+    def test_maxlag_retry(self):
+        lagged = json_response({"error": {"code": "maxlag", "info": "Waiting for a database server", "lag": 7}},
+                               headers={"Retry-After": "0"})
+        transport = unittest.mock.Mock()
+        transport.get.side_effect = [lagged, lagged, mock_requests_get(None, {
+            "prop": "pageassessments", "titles": "Mummy Cave"})]
+        client = wpvt.ApiClient(transport=transport, maxlag=3, max_rps=None, backoff=0)
+        result = wpvt.current_assessment("Mummy Cave", client=client)
+
+        self.assertIn("GA", result)
+        self.assertEqual(transport.get.call_count, 3)
+        self.assertEqual(transport.get.call_args[0][1]["maxlag"], 3)
+
+    def test_retry_on_failure(self):
+        unavailable = unittest.mock.Mock(status_code=503, headers={})
+        transport = unittest.mock.Mock()
+        transport.get.side_effect = [wpvt.requests.ConnectionError("reset"), unavailable, mock_requests_get(None, {
+            "prop": "pageassessments", "titles": "Mummy Cave"})]
+        client = wpvt.ApiClient(transport=transport, max_rps=None, backoff=0)
+        self.assertIn("GA", wpvt.current_assessment("Mummy Cave", client=client))
+        self.assertEqual(transport.get.call_count, 3)
+
+        transport.get.side_effect = wpvt.requests.ConnectionError("down")
+        client = wpvt.ApiClient(transport=transport, max_rps=None, backoff=0, max_retries=2)
+        with self.assertRaises(wpvt.requests.ConnectionError):
+            wpvt.current_assessment("Mummy Cave", client=client)
+
+    def test_rate_limiter(self):
+        limiter = wpvt.RateLimiter(50)
+        start = wpvt.time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(wpvt.time.monotonic() - start, 5 / 50)
+
+    def test_check_articles(self):
+        def fake_check(article_title, log=print, **kwargs):
+            log("Looking at {}.".format(article_title))
+            return [{"title": article_title, "listed_as": "B", "current": None}]
+
+        articles = ["Page {}".format(i) for i in range(5)]
+        with unittest.mock.patch('wpVitalsTender.article_list_assessment_check', side_effect=fake_check), \
+                unittest.mock.patch('builtins.print') as mock_print:
+            results = wpvt.check_articles(articles, workers=3)
+        self.assertEqual(list(results), articles)
+        self.assertEqual([c[0][0] for c in mock_print.call_args_list], ["Looking at {}.".format(a) for a in articles])
+
+        # the first page's output is printed as it comes, not once the page is done
+        printed_during_check = []
+
+        def logging_check(article_title, log=print, **kwargs):
+            log("Looking at {}.".format(article_title))
+            printed_during_check.append(mock_print.call_count)
+            return []
+
+        with unittest.mock.patch('wpVitalsTender.article_list_assessment_check', side_effect=logging_check), \
+                unittest.mock.patch('builtins.print') as mock_print:
+            wpvt.check_articles(articles[:1])
+        self.assertEqual(printed_during_check, [1])
+
+    def test_checkpoint_resume(self):
+        article_title = "Wikipedia:Vital articles/Level/1"
+        with tempfile.TemporaryDirectory() as tmp, unittest.mock.patch('builtins.print'):
+            checkpoint = wpvt.Checkpoint(os.path.join(tmp, "checkpoint.sqlite"))
+            expected = wpvt.article_list_assessment_check(article_title, log=lambda line: None)
+            content = wpvt.get_content(article_title)
+            chunk = next(wpvt.check_listings(wpvt.iter_listings(content)))
+            checkpoint.save_chunk(article_title, wpvt.Checkpoint.content_key(content), 0, chunk)
+
+            # the only chunk was already checked, so only the page content is fetched
+            self.mock_get.reset_mock()
+            mismatches = wpvt.article_list_assessment_check(article_title, log=lambda line: None,
+                                                            checkpoint=checkpoint)
+            self.assertEqual(mismatches, expected)
+            self.assertEqual([c[0][1]["prop"] for c in self.mock_get.call_args_list], ["revisions"])
+
+            def fake_check(article_title, **kwargs):
+                if article_title == "Page 1":
+                    raise wpvt.requests.ConnectionError("down")
+                return []
+
+            articles = ["Page 0", "Page 1", "Page 2"]
+            with unittest.mock.patch('wpVitalsTender.article_list_assessment_check', side_effect=fake_check) as check:
+                results = wpvt.check_articles(articles, checkpoint=checkpoint)
+                self.assertEqual(results, {"Page 0": [], "Page 1": None, "Page 2": []})
+                check.reset_mock()
+                check.side_effect = lambda article_title, **kwargs: []
+                results = wpvt.check_articles(articles, checkpoint=checkpoint)
+            self.assertEqual(results, {"Page 0": [], "Page 1": [], "Page 2": []})
+            self.assertEqual([c[0][0] for c in check.call_args_list], ["Page 1"])
+            checkpoint.close()
+
+    def test_sweep(self):
+        articles = ["Wikipedia:Vital articles/Level/1", "Wikipedia:Vital articles/Missing"]
+        expected = wpvt.article_list_assessment_check(articles[0], log=lambda line: None)
+        outputs = []
+        for processes in (1, 3):
+            with unittest.mock.patch('builtins.print') as mock_print, wpvt.RunMetrics() as metrics:
+                results = wpvt.sweep(articles, processes=processes, client_options={
+                    "transport": MockTransport(), "max_rps": 50}, split_sections=True)
+            self.assertEqual(results, {articles[0]: expected, articles[1]: None})
+            self.assertEqual(metrics.summary()["pages"][0]["title"], articles[0])
+            outputs.append([c[0][0] for c in mock_print.call_args_list])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertTrue(outputs[0][0].startswith("Looking at {}.".format(articles[0])))
+        self.assertTrue(outputs[0][1].startswith("Failed to check {}".format(articles[1])))
+
+    def test_split_sections(self):
+        article_title = "Wikipedia:Vital articles/Level/1"
+        content = wpvt.get_content(article_title)
+        expected = wpvt.article_list_assessment_check(article_title, log=lambda line: None)
+        titles = [l["title"] for l in wpvt.parse_article(content)]
+        assessments, redirects = wpvt.current_assessments_with_redirects(titles)
+        split = content.replace("# {{Icon|GA}} [[Language]]", "== More ==\n# {{Icon|GA}} [[Language]]")
+        with unittest.mock.patch('wpVitalsTender.get_content', return_value=split):
+            sections, page = wpvt._top_sections(article_title, wpvt.get_client())
+        self.assertEqual(page, split)
+        self.assertEqual(len(sections), 2)
+        # with counts, a section without listings is still checked if its heading gives a count
+        counted = split + "\n== Later (3 articles) ==\n"
+        with unittest.mock.patch('wpVitalsTender.get_content', return_value=counted):
+            self.assertEqual(wpvt._top_sections(article_title, wpvt.get_client())[0], sections)
+            with_counts = wpvt._top_sections(article_title, wpvt.get_client(), counts=True)[0]
+        self.assertEqual(with_counts, sections + ["3"])
+        lines = []
+        wpvt.article_list_assessment_check(article_title, "3", log=lines.append, counts=True, content=counted)
+        self.assertIn("Section \"Later (3 articles)\" says it lists 3 articles, but lists 0.", lines)
+        # each section is checked from the content handed over, without fetching the page or the section again
+        with unittest.mock.patch('wpVitalsTender.get_content', side_effect=AssertionError("fetched again")), \
+                unittest.mock.patch('wpVitalsTender.current_assessments_with_redirects', side_effect=lambda titles,
+                                    **kwargs: (assessments, {t: redirects[t] for t in titles if t in redirects})):
+            self.assertEqual([m for s in sections for m in wpvt.article_list_assessment_check(
+                article_title, s, log=lambda line: None, content=split)], expected)
+
+    def test_level_pages(self):
+        pages = ["Wikipedia:Vital articles/Level/5/People/Writers", "Wikipedia:Vital articles/Level/5/Arts",
+                 "Wikipedia:Vital articles/Level/5/History"]
+        responses = [{"continue": {"apcontinue": "History", "continue": "-||"},
+                      "query": {"allpages": [{"ns": 4, "title": t} for t in pages[:2]]}},
+                     {"batchcomplete": "", "query": {"allpages": [{"ns": 4, "title": pages[2]}]}}]
+        self.mock_get.side_effect = [json_response(r) for r in responses]
+
+        self.assertEqual(wpvt.level_pages(5), sorted(pages))
+        self.assertEqual(wpvt.level_pages(3), ["Wikipedia:Vital articles"])
+        params = [c[0][1] for c in self.mock_get.call_args_list]
+        self.assertEqual(len(params), 2)
+        self.assertEqual((params[0]["apnamespace"], params[0]["apprefix"]), (4, "Vital articles/Level/5/"))
+        self.assertEqual(params[1]["apcontinue"], "History")
+
+    def test_results_store(self):
+        article_title = "Wikipedia:Vital articles/Level/1"
+        with tempfile.TemporaryDirectory() as tmp:
+            store = wpvt.ResultsStore(os.path.join(tmp, "results.sqlite"))
+            first = store.start_run(date="2024-01-01 00:00:00")
+            mismatches = wpvt.article_list_assessment_check(article_title, log=lambda line: None,
+                                                            results_store=store)
+            self.assertEqual([{k: m[k] for k in ("title", "listed_as", "current")} for m in store.mismatches()],
+                             sorted(mismatches, key=lambda m: m["title"]))
+            self.assertEqual(store.diff()["new"], store.mismatches())
+
+            resolved, unchanged = store.mismatches()[0], store.mismatches()[1:]
+            store.start_run(date="2024-01-02 00:00:00")
+            new = wpvt.ChunkResult([wpvt.Listing("Earth", "B")], {"Earth": ["GA"]}, {}, [
+                {"title": "Earth", "listed_as": "B", "current": ["GA"]}] + [
+                {k: m[k] for k in ("title", "listed_as", "current")} for m in unchanged], None)
+            store.save_chunk(article_title, new)
+            diff = store.diff()
+            self.assertEqual([m["title"] for m in diff["new"]], ["Earth"])
+            self.assertEqual(diff["resolved"], [resolved])
+            self.assertEqual(diff["unchanged"], unchanged)
+            self.assertEqual([run for run, date in store.runs()], [first, store.run])
+            # mismatches can only be resolved on pages that were checked again
+            second = store.run
+            store.start_run()
+            store.save_chunk("Wikipedia:Vital articles/Level/2", new._replace(mismatches=[]))
+            self.assertEqual(store.diff()["resolved"], [])
+            store.run = second
+
+            csv_path, jsonl_path = os.path.join(tmp, "mismatches.csv"), os.path.join(tmp, "mismatches.jsonl")
+            self.assertEqual(store.export(csv_path), len(unchanged) + 1)
+            store.export(jsonl_path, run=first)
+            with open(csv_path) as f:
+                self.assertEqual(f.readline().strip(), "date,page,title,listed_as,current")
+                self.assertTrue(f.readline().startswith("2024-01-02 00:00:00,{},Earth,B,GA".format(article_title)))
+            with open(jsonl_path) as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(len(records), len(mismatches))
+            self.assertEqual(records[0]["date"], "2024-01-01 00:00:00")
+            store.close()
+
+    def test_results_store_split_sweep(self):
+        article_title = "Wikipedia:Vital articles/Sectioned"
+        with tempfile.TemporaryDirectory() as tmp:
+            store = wpvt.ResultsStore(os.path.join(tmp, "results.sqlite"))
+            store.start_run()
+            with unittest.mock.patch('builtins.print'):
+                split = wpvt.sweep([article_title], processes=2, split_sections=True, results_store=store,
+                                   client=wpvt.ApiClient(transport=SectionedPageTransport(), max_rps=None),
+                                   client_options={"transport": SectionedPageTransport(), "max_rps": None})
+            store.start_run()
+            with unittest.mock.patch('builtins.print'):
+                whole = wpvt.check_articles([article_title], results_store=store,
+                                            client=wpvt.ApiClient(transport=SectionedPageTransport(), max_rps=None))
+            self.assertEqual(split, whole)
+            self.assertEqual(len(whole[article_title]), 10)
+            # the sections the sweep split the page into were saved as the page, so the runs compare
+            diff = store.diff()
+            self.assertEqual((len(diff["new"]), len(diff["resolved"]), len(diff["unchanged"])), (0, 0, 10))
+            store.close()
+
+    def test_async_api(self):
+        article_title = "Wikipedia:Vital articles/Level/1"
+        expected = wpvt.article_list_assessment_check(article_title, log=lambda line: None)
+        titles = ["Earth", "Life", "Human", "History of the world", "Culture", "Language", "The arts", "Science",
+                  "Technology", "Mathematics"]
+
+        async def check():
+            return [m async for m in wpvt.async_article_list_assessment_check(article_title)]
+
+        async def run():
+            content = await wpvt.async_get_content(article_title)
+            assessments = await wpvt.async_current_assessments_with_redirects(titles)
+            # several checks share the one client on the same event loop
+            return content, assessments, await wpvt.asyncio.gather(check(), check())
+
+        content, assessments, results = wpvt.asyncio.run(run())
+        self.assertEqual(content, wpvt.get_content(article_title))
+        self.assertEqual(assessments, wpvt.current_assessments_with_redirects(titles))
+        self.assertEqual(results, [expected, expected])
+
+    def test_async_rate_limit(self):
+        threads = []
+
+        def transport_get(*args, **kwargs):
+            threads.append(wpvt.threading.current_thread().name)
+            return mock_requests_get(*args, **kwargs)
+
+        client = wpvt.ApiClient(transport=mock_transport(transport_get), max_rps=20, workers=2)
+        article_title = "Wikipedia:Vital articles/Level/1"
+
+        async def run():
+            return await wpvt.asyncio.gather(*[wpvt.async_get_content(article_title, client=client)
+                                               for _ in range(4)])
+
+        start = wpvt.time.monotonic()
+        # every wait for the rate limit is on the event loop, none in the worker threads
+        with unittest.mock.patch('wpVitalsTender.time.sleep', side_effect=AssertionError("worker thread slept")):
+            results = wpvt.asyncio.run(run())
+        self.assertGreaterEqual(wpvt.time.monotonic() - start, 3 / 20)
+        self.assertEqual(len(set(results)), 1)
+        self.assertEqual(client.executor._max_workers, 2)
+        self.assertTrue(all(name.startswith("ApiClient") for name in threads))
+        client.close()
+
+    def test_async_rate_limit_fan_out(self):
+        times = []
+        parsed_in = []
+
+        def transport_get(*args, **kwargs):
+            times.append(wpvt.time.monotonic())
+            return json_response({"batchcomplete": "", "query": {"pages": {
+                str(i): {"title": t, "pageassessments": {"Project": {"class": "B"}}}
+                for i, t in enumerate(args[1]["titles"].split("|"))}}})
+
+        def listings():
+            for i in range(150):
+                parsed_in.append(wpvt.threading.current_thread().name)
+                yield {"title": "Article {}".format(i), "assessment": "B", "history": None}
+
+        client = wpvt.ApiClient(transport=mock_transport(transport_get), max_rps=20, workers=3)
+
+        async def run():
+            return [chunk async for chunk in wpvt.async_check_listings(listings(), client=client, chunk_size=150)]
+
+        chunks = wpvt.asyncio.run(run())
+        self.assertEqual(len(chunks[0].listings), 150)
+        # the chunk's three queries of 50 titles each wait for their own slot
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(max(times) - min(times), 2 / 20 - .01)
+        # and the listings are pulled into chunks off the event loop
+        self.assertTrue(all(name.startswith("ApiClient") for name in parsed_in))
+        client.close()
+
+    def test_former_statuses(self):
+        members = {"Category:Wikipedia former featured articles": [["Talk:Human"]],
+                   "Category:Delisted good articles": [["Talk:Human", "Talk:Culture"], ["Talk:Earth"]],
+                   "Category:Wikipedia former featured lists": [[]]}
+
+        def transport_get(*args, **kwargs):
+            if args[1].get("list") != "categorymembers":
+                return mock_requests_get(*args, **kwargs)
+            pages = members[args[1]["cmtitle"]]
+            i = int(args[1].get("cmcontinue", 0))
+            result = {"query": {"categorymembers": [{"ns": 1, "title": t} for t in pages[i]]}}
+            if i + 1 < len(pages):
+                result["continue"] = {"cmcontinue": str(i + 1), "continue": "-||"}
+            return json_response(result)
+
+        self.mock_get.side_effect = transport_get
+        article_title = "Wikipedia:Vital articles/Level/1"
+        lines = []
+        chunks = []
+        with tempfile.TemporaryDirectory() as tmp:
+            store = wpvt.ResultsStore(os.path.join(tmp, "results.sqlite"))
+            store.start_run()
+            mismatches = wpvt.article_list_assessment_check(article_title, log=lines.append, former=True,
+                                                            on_chunk=chunks.append, results_store=store)
+            self.assertEqual(store.export(os.path.join(tmp, "export.jsonl"), former=True), len(mismatches))
+            with open(os.path.join(tmp, "export.jsonl")) as f:
+                exported = [json.loads(line) for line in f]
+            self.assertEqual(store.former_mismatches(), [dict(m, page=article_title) for m in chunks[0].former])
+            store.close()
+        self.assertEqual([line for line in lines if line.startswith("Former")], [
+            "Former status mismatch! Earth marked as no former status, currently DGA",
+            "Former status mismatch! Human history marked as DGA, currently none",
+            "Former status mismatch! Mathematics marked as DGA, currently none"])
+        self.assertEqual(lines[-1], "3 former status mismatches found.")
+        former = [{"title": "Earth", "marked": [], "former": ["DGA"]},
+                  {"title": "Human history", "marked": ["DGA"], "former": []},
+                  {"title": "Mathematics", "marked": ["DGA"], "former": []}]
+        self.assertEqual(chunks[0].former, former)
+        self.assertEqual(mismatches[-3:], former)
+        self.assertEqual([{k: m[k] for k in ("title", "marked", "former")} for m in exported if "marked" in m], former)
+        self.assertEqual(wpvt.former_statuses(), {"Human": {"FFA", "DGA"}, "Culture": {"DGA"}, "Earth": {"DGA"}})
+        # looked up once for the client, until they are older than the cache ttl
+        category_calls = lambda: [c for c in self.mock_get.call_args_list if c[0][1].get("list") == "categorymembers"]
+        self.assertEqual(len(category_calls()), 4)
+        with unittest.mock.patch('time.monotonic', return_value=wpvt.time.monotonic() + wpvt.DEFAULT_CACHE_TTL + 1):
+            wpvt.former_statuses()
+        self.assertEqual(len(category_calls()), 8)
+
+        self.assertEqual(wpvt.find_former_mismatches([wpvt.Listing("Human", "B", "FFA DGA"),
+                                                      wpvt.Listing("Culture", "C", "FGAN DGA"),
+                                                      wpvt.Listing("Life", "B", "FFL")], wpvt.former_statuses()),
+                         [{"title": "Life", "marked": ["FFL"], "former": []}])
+
+    def test_response_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = wpvt.ResponseCache(os.path.join(tmp, "cache.sqlite"), ttl=60, max_entries=2)
+            cache.put({"titles": "A"}, {"n": 1}, revision=10)
+            cache.put({"titles": "B"}, {"n": 2})
+
+            self.assertEqual(cache.get({"titles": "A"}, revision=10), {"n": 1})
+            self.assertIsNone(cache.get({"titles": "A"}, revision=11))
+            self.assertIsNone(cache.get({"titles": "A"}))
+            self.assertEqual(cache.get({"titles": "A"}, revision=11, fresh_only=False), {"n": 1})
+            # a hit only reads
+            changes = cache._db.total_changes
+            self.assertEqual(cache.get({"titles": "B"}), {"n": 2})
+            self.assertEqual(cache._db.total_changes, changes)
+            with unittest.mock.patch('time.time', return_value=wpvt.time.time() + 61):
+                self.assertIsNone(cache.get({"titles": "B"}))
+
+            # A was used most recently, so B is evicted
+            cache.get({"titles": "A"}, revision=10)
+            cache.put({"titles": "C"}, {"n": 3})
+            self.assertEqual(len(cache), 2)
+            self.assertIsNone(cache.get({"titles": "B"}, fresh_only=False))
+            cache.close()
+
+    def test_get_content_cached(self):
+        revision = {"lastrevid": 100}
+
+        def transport_get(*args, **kwargs):
+            if args[1]["prop"] == "info":
+                return json_response({"query": {"pages": {"1": dict(revision, title=args[1]["titles"])}}})
+            return mock_requests_get(*args, **kwargs)
+
+        article_title = "Wikipedia:Vital articles/Level/1"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.sqlite")
+            transport = mock_transport(transport_get)
+            client = wpvt.ApiClient(transport=transport, max_rps=None, cache=wpvt.ResponseCache(path))
+            content = wpvt.get_content(article_title, client=client)
+            self.assertEqual(wpvt.get_content(article_title, client=client), content)
+            # two revision checks, but the content was only downloaded once
+            self.assertEqual([c[0][1]["prop"] for c in transport.get.call_args_list], ["info", "revisions", "info"])
+
+            revision["lastrevid"] = 101
+            wpvt.get_content(article_title, client=client)
+            self.assertEqual(transport.get.call_args[0][1]["prop"], "revisions")
+            client.close()
+
+            offline = wpvt.ApiClient(transport=unittest.mock.Mock(), cache=wpvt.ResponseCache(path), offline=True)
+            self.assertEqual(wpvt.get_content(article_title, client=offline), content)
+            self.assertRaises(LookupError, wpvt.current_assessment, "Mummy Cave", client=offline)
+            offline.transport.get.assert_not_called()
+            offline.close()
+
+    def test_current_assessments_incremental(self):
+        with open('test_docs/test_Level1_assessments.json', 'r') as f:
+            level1 = json.loads(f.read())
+        talk_revisions = {"Talk:" + p["title"]: 500 + i for i, p in enumerate(level1["query"]["pages"].values())}
+
+        def transport_get(*args, **kwargs):
+            titles = args[1]["titles"].split("|")
+            if args[1]["prop"] == "info":
+                pages = {str(i): {"title": t.replace("History of the world", "Human history"),
+                                  "lastrevid": talk_revisions[t.replace("History of the world", "Human history")]}
+                         for i, t in enumerate(titles)}
+                return json_response({"batchcomplete": "", "query": {"pages": pages, "redirects": [
+                    {"from": "Talk:History of the world", "to": "Talk:Human history"}]}})
+            resolved = [t.replace("History of the world", "Human history") for t in titles]
+            return json_response({"batchcomplete": "", "query": {
+                "redirects": level1["query"]["redirects"],
+                "pages": {k: p for k, p in level1["query"]["pages"].items() if p["title"] in resolved}}})
+
+        titles = ["Earth", "Life", "Human", "History of the world", "Culture", "Language", "The arts", "Science",
+                  "Technology", "Mathematics"]
+        expected = wpvt.current_assessments_with_redirects(titles)
+        with tempfile.TemporaryDirectory() as tmp:
+            store = wpvt.WatermarkStore(os.path.join(tmp, "state.sqlite"))
+            transport = mock_transport(transport_get)
+            client = wpvt.ApiClient(transport=transport, max_rps=None)
+
+            first = wpvt.current_assessments_incremental(titles, store, client=client)
+            self.assertEqual(first[:2], expected)
+            self.assertEqual(first[2], titles)
+
+            transport.get.reset_mock()
+            second = wpvt.current_assessments_incremental(titles, store, client=client)
+            self.assertEqual(second[:2], expected)
+            self.assertEqual(second[2], [])
+            self.assertEqual([c[0][1]["prop"] for c in transport.get.call_args_list], ["info"])
+
+            talk_revisions["Talk:Human history"] += 1
+            third = wpvt.current_assessments_incremental(titles, store, client=client)
+            self.assertEqual(third[:2], expected)
+            self.assertEqual(third[2], ["History of the world"])
+            self.assertEqual(transport.get.call_args[0][1]["titles"], "History of the world")
+            store.close()
+
+    def test_incremental_with_cache(self):
+        talk_revision, current = [1], ["GA"]
+
+        def transport_get(*args, **kwargs):
+            if args[1]["prop"] == "info":
+                return json_response({"batchcomplete": "", "query": {"pages": {
+                    "1": {"title": "Talk:Earth", "lastrevid": talk_revision[0]}}}})
+            return json_response({"batchcomplete": "", "query": {"pages": {
+                "1": {"title": "Earth", "pageassessments": {"Geology": {"class": current[0]}}}}}})
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = wpvt.WatermarkStore(os.path.join(tmp, "state.sqlite"))
+            cache = wpvt.ResponseCache(os.path.join(tmp, "cache.sqlite"))
+            client = wpvt.ApiClient(transport=mock_transport(transport_get), max_rps=None, cache=cache)
+            self.assertEqual(wpvt.current_assessments_incremental(["Earth"], store, client=client)[0],
+                             {"Earth": ["GA"]})
+            # the class changes with the talk page, well within the cache's ttl
+            talk_revision[0], current[0] = 2, "FA"
+            assessments, redirects, changed = wpvt.current_assessments_incremental(["Earth"], store, client=client)
+            self.assertEqual((assessments, changed), ({"Earth": ["FA"]}, ["Earth"]))
+            self.assertEqual(wpvt.current_assessments_incremental(["Earth"], store, client=client)[::2],
+                             ({"Earth": ["FA"]}, []))
+            store.close()
+            cache.close()
+
+    def test_check_listings_streams(self):
+        def transport_get(*args, **kwargs):
+            titles = args[1]["titles"].split("|")
+            return json_response({"batchcomplete": "", "query": {"pages": {
+                str(i): {"title": t, "pageassessments": {"Project": {"class": "B" if i % 10 else "C"}}}
+                for i, t in enumerate(titles)}}})
+
+        consumed = []
+
+        def listings():
+            for i in range(120):
+                consumed.append(i)
+                yield {"title": "Article {}".format(i), "assessment": "B", "history": None}
+
+        transport = mock_transport(transport_get)
+        client = wpvt.ApiClient(transport=transport, max_rps=None, workers=1)
+        chunks = wpvt.check_listings(listings(), client=client)
+        first = next(chunks)
+        # the first chunk is reported before the rest of the listings have been read
+        self.assertEqual(len(consumed), 50)
+        self.assertEqual([m["title"] for m in first.mismatches], ["Article {}".format(i) for i in range(0, 50, 10)])
+        self.assertEqual([len(c.listings) for c in chunks], [50, 20])
+        self.assertEqual(len(list(wpvt.stream_mismatches(listings(), client=client))), 12)
 
     def test_parse_article(self):
         with open('test_docs/test_parse_article.txt', 'r') as article_file:
@@ -77,8 +625,7 @@ class TestWpVitalsTender(unittest.TestCase):
             self.assertEqual("B", result[12]["assessment"])
             self.assertEqual("DGA", result[12]["history"])
 
-    @unittest.mock.patch('requests.get', side_effect=mock_requests_get)
-    def test_find_redirects(self, mock_get):
+    def test_find_redirects(self):
         articles = ['Buildings', 'Bricks', 'Houses', 'WW2', 'WW1', 'Cup']
         redirects = ['Building', 'Brick', 'House', 'World War II', 'World War I', None]
         results = wpvt.find_redirects(articles)
@@ -88,16 +635,118 @@ class TestWpVitalsTender(unittest.TestCase):
             else:
                 self.assertNotIn(a, results)
 
-    @unittest.mock.patch('requests.get', side_effect=mock_requests_get)
-    def test_current_assessment(self, mock_get):
+    def test_current_assessment(self):
         article_title = "Mummy Cave"
         result = wpvt.current_assessment(article_title)
 
         self.assertIn("GA", result)
         self.assertEqual(len(result), 5)
 
-    @unittest.mock.patch('requests.get', side_effect=mock_requests_get)
-    def test_current_assessments(self, mock_get):
+    def test_current_assessments_with_redirects(self):
+        titles = ["Earth", "Life", "Human", "History of the world", "Culture", "Language", "The arts", "Science",
+                  "Technology", "Mathematics"]
+        assessments, redirects = wpvt.current_assessments_with_redirects(titles)
+
+        self.assertEqual(redirects, {"History of the world": "Human history"})
+        self.assertEqual(assessments["Human history"], ["C", "C"])
+        self.assertNotIn("Technology", assessments)
+        self.assertEqual(self.mock_get.call_args[0][1]["redirects"], "")
+
+    def test_linked_assessments(self):
+        article_title = "Wikipedia:Vital articles/Level/1"
+        expected = wpvt.article_list_assessment_check(article_title, log=lambda line: None)
+        with open('test_docs/test_Level1_assessments.json', 'r') as f:
+            level1 = json.loads(f.read())
+        pages = list(level1["query"]["pages"].items())
+        # the links are split over two responses, and Earth's assessments over both of them
+        earth = next(k for k, p in pages if p["title"] == "Earth")
+        first = {k: dict(p) for k, p in pages[:6]}
+        second = {k: dict(p) for k, p in pages[6:]}
+        projects = list(first[earth]["pageassessments"].items())
+        first[earth]["pageassessments"] = dict(projects[:1])
+        second[earth] = dict(first[earth], pageassessments=dict(projects[1:]))
+        responses = [{"continue": {"pacontinue": "1|2", "continue": "||"}, "query": {
+                          "redirects": level1["query"]["redirects"], "pages": first}},
+                     {"batchcomplete": "", "query": {"pages": second}}]
+
+        def transport_get(*args, **kwargs):
+            if args[1].get("generator") == "links":
+                return json_response(responses[1 if "pacontinue" in args[1] else 0])
+            return mock_requests_get(*args, **kwargs)
+
+        self.mock_get.side_effect = transport_get
+        assessments, redirects, titles = wpvt.linked_assessments(article_title)
+        self.assertEqual(len(assessments["Earth"]), len(projects))
+        self.assertEqual(redirects, {"History of the world": "Human history"})
+        self.assertIn("Technology", titles)
+
+        self.mock_get.reset_mock()
+        mismatches = wpvt.article_list_assessment_check(article_title, log=lambda line: None, links=True)
+        self.assertEqual(mismatches, expected)
+        self.assertEqual([c[0][1].get("generator") for c in self.mock_get.call_args_list
+                          if c[0][1].get("prop") == "pageassessments"], ["links", "links"])
+
+        # a section is looked up by title, rather than with the links of the whole page
+        self.mock_get.reset_mock()
+        wpvt.article_list_assessment_check(article_title, "1", log=lambda line: None, links=True)
+        self.assertNotIn("links", [c[0][1].get("generator") for c in self.mock_get.call_args_list])
+
+        # listings are matched to links as the API normalizes them, and any the links don't cover are queried
+        linked = ({"Earth": ["FA"]}, {}, {"Earth"})
+        with unittest.mock.patch('wpVitalsTender.current_assessments_with_redirects',
+                                 return_value=({"Mummy Cave": ["GA"]}, {"Mummy_Cave": "Mummy Cave"})) as query:
+            result = wpvt._from_linked(["earth", "Mummy_Cave"], linked, wpvt.get_client())
+        query.assert_called_once_with(["Mummy_Cave"], client=wpvt.get_client())
+        self.assertEqual(result, ({"Earth": ["FA"], "Mummy Cave": ["GA"]},
+                                  {"earth": "Earth", "Mummy_Cave": "Mummy Cave"}))
+
+    def test_article_list_assessment_check(self):
+        with unittest.mock.patch('builtins.print'):
+            results = wpvt.article_list_assessment_check("Wikipedia:Vital articles/Level/1", accuracy=.5)
+
+        # one call for the page content and one for redirects and assessments together
+        self.assertEqual(self.mock_get.call_count, 2)
+        self.assertEqual(results, [
+            {"title": "Human history", "listed_as": "B", "current": ["C", "C"]},
+            {"title": "Technology", "listed_as": "B", "current": None},
+        ])
+
+    def test_run_metrics(self):
+        events = []
+
+        def hook(event, data):
+            events.append(event)
+
+        wpvt.add_hook(hook)
+        try:
+            with wpvt.RunMetrics() as metrics, unittest.mock.patch('builtins.print'):
+                wpvt.article_list_assessment_check("Wikipedia:Vital articles/Level/1", accuracy=.5)
+        finally:
+            wpvt.remove_hook(hook)
+        summary = metrics.summary()
+
+        self.assertEqual(summary["requests"]["count"], 2)
+        self.assertEqual(summary["requests"]["by_operation"]["get_content"]["count"], 1)
+        self.assertEqual(summary["requests"]["by_operation"]["batch_query"]["count"], 1)
+        self.assertEqual(summary["chunks"], {"count": 1, "calls": 1, "max_continue_chain": 1,
+                                             "mean_continue_chain": 1})
+        self.assertEqual(summary["pages"][0]["title"], "Wikipedia:Vital articles/Level/1")
+        self.assertEqual(summary["pages"][0]["listings"], 10)
+        self.assertEqual(summary["pages"][0]["mismatches"], 2)
+        self.assertEqual(set(summary["phases"]), {"parse", "network", "analysis"})
+        self.assertIn("article_list_assessment_check", summary["operations"])
+        self.assertEqual(summary["retries"]["count"], 0)
+        self.assertIn("request", events)
+        wpvt.json.dumps(summary)
+
+    def test_run_metrics_continue_chains(self):
+        with wpvt.RunMetrics() as metrics:
+            wpvt.current_assessments(['Building', 'Infrastructure', 'Brick', 'Cement', 'Concrete', 'Lumber'])
+        summary = metrics.summary()
+        self.assertEqual(summary["chunks"]["max_continue_chain"], 12)
+        self.assertEqual(summary["operations"]["current_assessments"]["count"], 1)
+
+    def test_current_assessments(self):
         article_titles = ['Building', 'Infrastructure', 'Brick', 'Cement', 'Concrete', 'Lumber', 'Masonry', 'Quarry',
                           'Scaffolding', 'Arch', 'Ceiling', 'Column', 'Dome', 'Door', 'Elevator', 'Facade', 'Floor',
                           'Foundation (engineering)', 'Lighting', 'Roof', 'Room', 'Stairs', 'Wall', 'Window', 'Harbor',
@@ -140,6 +789,114 @@ class TestWpVitalsTender(unittest.TestCase):
         for article, assessments in result.items():
             self.assertCountEqual(assessments, article_qualities[article])
 
+        sequential = wpvt.batch_query({"prop": "pageassessments"}, article_titles, workers=1)
+        concurrent = wpvt.batch_query({"prop": "pageassessments"}, article_titles, workers=4)
+        self.assertEqual(sequential, concurrent)
+        self.assertEqual(len(concurrent), len(article_qualities))
+
+    def test_mismatch_engine(self):
+        with open('test_docs/test_parse_article.txt', 'r') as article_file:
+            listings = list(wpvt.iter_listings(article_file.read()))
+        assessments = {
+            "Land": ["C"],
+            "Desert": ["GA", "B"],
+            "Sahara": ["B"],
+            "Glacier": ["", ""],
+            "Grand Canyon": ["Start", "stub", "B"],
+            "Mountain": ["Start", "c", "C"],
+            "Alps (mountains)": ["c", "c", "b", "Start"],
+            "Andes": ["Start"],
+            "Himalayas": ["B"],
+            "Mount Everest": ["Start"],
+            "E (mathematical constant)": ["FA"],
+            "Rocky Mountains": ["B"],
+        }
+        engine = wpvt.MismatchEngine(listings[:5], assessments)
+        engine.add(listings[5:], assessments)
+        ratios = engine.ratios()
+
+        self.assertEqual(ratios[0], 1.0)
+        self.assertEqual(ratios[1], .5)
+        self.assertEqual(ratios[3], -1.0)  # Forest has no assessments
+        self.assertTrue(wpvt.math.isnan(ratios[4]))  # Glacier's projects gave no class
+        self.assertAlmostEqual(ratios[5], 1 / 3)
+
+        accuracies = [0, .01, .34, .5, .51, 1]
+        by_accuracy = engine.mismatches_by_accuracy(accuracies)
+        for accuracy in accuracies:
+            self.assertEqual(by_accuracy[accuracy], engine.mismatches(accuracy))
+            self.assertEqual(by_accuracy[accuracy], wpvt.find_mismatches(listings, assessments, accuracy))
+        self.assertEqual([m["title"] for m in by_accuracy[.34]],
+                         ["Sahara", "Forest", "Grand Canyon", "Himalayas"])
+        self.assertEqual(len(by_accuracy[1]), 7)
+
+    def test_listing(self):
+        with open('test_docs/test_parse_article.txt', 'r') as article_file:
+            content = article_file.read()
+        listings = list(wpvt.iter_listings(content))
+
+        self.assertEqual([l.as_dict() for l in listings], wpvt.parse_article(content))
+        self.assertFalse(hasattr(listings[0], "__dict__"))
+        self.assertEqual(listings[4]["history"], "DGA")
+        self.assertIs(listings[4].history, listings[12].history)
+        self.assertEqual(listings[1].code, listings[2].code)
+        self.assertEqual(wpvt.class_name(listings[2].code), "ga")
+        self.assertEqual(wpvt.class_code(""), 0)
+        self.assertEqual(wpvt.class_code("Unheard-of"), wpvt.class_code("unheard-OF"))
+        self.assertEqual(wpvt.Listing.from_dict(listings[4].as_dict()), listings[4])
+
+        # a listing pickled in another process carries that process's code for a class it made up
+        listing = wpvt.Listing("X", "Made-up", "DGA", section=3)
+        listing.code = 999
+        restored = pickle.loads(pickle.dumps(listing))
+        self.assertEqual(restored, listing)
+        self.assertEqual(restored.section, 3)
+        self.assertEqual(restored.code, wpvt.class_code("made-up"))
+
+    def test_section_index(self):
+        with open('test_docs/test_parse_article.txt', 'r') as article_file:
+            content = article_file.read()
+        content += ("\n== Other (2 articles) ==\n=== Sub ===\n* {{Icon|B}} [[X]]\n"
+                    "==== Subsub ====\n* {{Icon|C}} [[Y|Why]]\n== Last ==\n# {{icon|FA}} [[Z]]\n")
+        index = wpvt.SectionIndex(content)
+
+        self.assertEqual([s.heading for s in index.sections],
+                         ["", "Current total: 1000", "Terrestrial features (12 articles)", "Other (2 articles)", "Sub",
+                          "Subsub", "Last"])
+        self.assertEqual([s.level for s in index.sections], [0, 2, 3, 2, 3, 4, 2])
+        self.assertEqual(index.listings, list(wpvt.iter_listings(content)))
+        self.assertEqual(len(index.section_listings(1)), 13)
+        self.assertEqual(len(index.section_listings(1, subsections=False)), 0)
+        self.assertEqual([l.title for l in index.section_listings(index.find("other"))], ["X", "Y"])
+        self.assertEqual([l.section for l in index.section_listings(3)], [4, 5])
+        self.assertEqual(index.section_content(3),
+                         "== Other (2 articles) ==\n=== Sub ===\n* {{Icon|B}} [[X]]\n"
+                         "==== Subsub ====\n* {{Icon|C}} [[Y|Why]]\n")
+        self.assertEqual(index.section_content(6), "== Last ==\n# {{icon|FA}} [[Z]]\n")
+        self.assertTrue(index.section_content(0).startswith("This list is tailored"))
+        self.assertTrue(index.section_content(0).endswith("Frequently Asked Questions (FAQ) page]].\n"))
+        self.assertRaises(KeyError, index.find, "Missing")
+
+    def test_count_discrepancies(self):
+        with open('test_docs/test_parse_article.txt', 'r') as article_file:
+            content = article_file.read()
+        content += ("\n== Other (2 articles) ==\n=== Sub (1,000/1,000 articles) ===\n* {{Icon|B}} [[X]]\n"
+                    "==== Subsub ====\n* {{Icon|C}} [[Y|Why]]\n")
+        index = wpvt.SectionIndex(content)
+        self.assertEqual(index.count_discrepancies(), [
+            {"section": 2, "heading": "Terrestrial features (12 articles)", "listed": 12, "counted": 13},
+            {"section": 4, "heading": "Sub (1,000/1,000 articles)", "listed": 1000, "counted": 2}])
+        self.assertEqual([d["section"] for d in index.count_discrepancies(3)], [4])
+
+        # reported from the content already fetched for the check
+        lines = []
+        with unittest.mock.patch('wpVitalsTender.get_content', return_value=content) as get_content, \
+                unittest.mock.patch('wpVitalsTender.check_listings', return_value=[]) as check_listings:
+            wpvt.article_list_assessment_check("Page", log=lines.append, counts=True)
+        get_content.assert_called_once()
+        self.assertEqual(check_listings.call_args[0][0], index.listings)
+        self.assertIn('Section "Terrestrial features (12 articles)" says it lists 12 articles, but lists 13.', lines)
+
     def test_find_mismatches(self):
         with open('test_docs/test_parse_article.txt', 'r') as article_file:
             test_content = article_file.read()
@@ -159,6 +916,7 @@ class TestWpVitalsTender(unittest.TestCase):
                 "Rocky Mountains": ["B"],
             }
             results = wpvt.find_mismatches(listings, assessments, .5)
+            self.assertEqual(wpvt.find_mismatches(wpvt.iter_listings(test_content), assessments, .5), results)
 
             self.assertEqual(len(results), 4)
             self.assertIn({"title": "Forest", "listed_as": "B", "current": None}, results)
@@ -11,11 +11,54 @@ detect mismatches between an article's listed and actual assessed quality.
 
 
 import re
+import csv
+import sys
+import json
+import asyncio
+import math
+import hashlib
+import time
+import array
+import bisect
+import sqlite3
 import argparse
+import functools
+import itertools
+import threading
+import weakref
+import multiprocessing
+import contextlib
+import contextvars
+import collections
+import concurrent.futures
 import requests
+import requests.adapters
+try:
+    import numpy
+except ImportError:
+    # optional, MismatchEngine computes its ratios in pure Python without it
+    numpy = None
 
 
 USER_AGENT = "wpVitalsTender (https://github.com/mgbennet/wpVitalsTender)"
+API_URL = "https://en.wikipedia.org/w/api.php"
+# see https://www.mediawiki.org/wiki/API:Etiquette and https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_RPS = 10
+DEFAULT_MAXLAG = 5
+DEFAULT_TIMEOUT = 60
+DEFAULT_RETRIES = 5
+# HTTP statuses and API error codes worth waiting out and retrying
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = {"maxlag", "ratelimited", "readonly"}
+DEFAULT_CACHE_FILE = "wpvt_cache.sqlite"
+DEFAULT_CACHE_TTL = 24 * 60 * 60
+DEFAULT_CACHE_SIZE = 100000
+DEFAULT_STATE_FILE = "wpvt_state.sqlite"
+DEFAULT_CHECKPOINT_FILE = "wpvt_checkpoint.sqlite"
+DEFAULT_RESULTS_FILE = "wpvt_results.sqlite"
+# seconds a store waits for another process, such as a sweep worker, to finish writing to its file
+SQLITE_TIMEOUT = 60
 
 default_article = "Wikipedia:Vital articles/Level/2"
 all_articles = [
@@ -34,42 +77,1094 @@ all_articles = [
     "Wikipedia:Vital articles/Level/4/Technology",
     "Wikipedia:Vital articles/Level/4/Mathematics"
 ]
+# history icons for a former status, and the category its article's talk page is put in by {{Article history}}
+FORMER_STATUS_CATEGORIES = {
+    "FFA": "Category:Wikipedia former featured articles",
+    "DGA": "Category:Delisted good articles",
+    "FFL": "Category:Wikipedia former featured lists",
+}
+# pages listing the articles of each level. Levels 4 and 5 are split into subpages, see level_pages
+level_articles = {
+    1: "Wikipedia:Vital articles/Level/1",
+    2: "Wikipedia:Vital articles/Level/2",
+    3: "Wikipedia:Vital articles",
+    4: "Wikipedia:Vital articles/Level/4",
+    5: "Wikipedia:Vital articles/Level/5",
+}
 
 
-def article_list_assessment_check(article_title, section=None, accuracy=.01):
+_hooks = []
+# name of the function whose API calls are being made, for the "request" events
+_operation = contextvars.ContextVar("operation", default=None)
+# rate limiter whose next slot was already waited for on an event loop, see ApiClient.run
+_reserved_slot = contextvars.ContextVar("reserved_slot", default=None)
+
+
+def add_hook(hook):
+    """Registers hook(event, data) to be called for every instrumentation event. Events, with their data dict:
+    "request": one HTTP call. operation, seconds, bytes, attempt
+    "retry": a call about to be retried. operation, reason, wait
+    "cache": a query looked up in the ResponseCache. operation, hit
+    "chunk": one batch_query chunk, its "continue" chain followed. operation, titles, calls, seconds
+    "operation": get_content, find_redirects, batch_query etc. finishing. operation, seconds
+    "phase": time spent parsing listings or analysing assessments. phase, seconds
+    "page": article_list_assessment_check finishing a page. title, listings, mismatches, seconds
+    Hooks may be called from several threads at once.
+    """
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+def emit(event, **data):
+    """Calls every hook with an instrumentation event."""
+    for hook in list(_hooks):
+        hook(event, data)
+
+
+@contextlib.contextmanager
+def instrumented(operation):
+    """Attributes API calls made inside the block to operation, and emits its duration when done."""
+    token = _operation.set(operation)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+        emit("operation", operation=operation, seconds=time.perf_counter() - start)
+
+
+def _instrument(func):
+    """Decorator running func as an instrumented operation named after it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with instrumented(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _in_context(func):
+    """Wraps func to run in a copy of the current context, so worker threads keep the caller's operation."""
+    context = contextvars.copy_context()
+    # a rate limit slot reserved by ApiClient.run is for one request, not one in every worker thread
+    context.run(_reserved_slot.set, None)
+    return lambda *args: context.copy().run(func, *args)
+
+
+class RunMetrics:
+    """Hook collecting instrumentation events into a summary of a run, see summary().
+    Register it with add_hook(metrics), or use it as a context manager to add and remove it."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._end = None
+        self.requests = collections.defaultdict(lambda: {"count": 0, "seconds": 0.0, "bytes": 0})
+        self.operations = collections.defaultdict(lambda: {"count": 0, "seconds": 0.0})
+        self.retries = collections.defaultdict(lambda: {"count": 0, "wait_seconds": 0.0})
+        self.cache = {"hits": 0, "misses": 0}
+        self.chunk_calls = []
+        self.phases = collections.defaultdict(float)
+        self.pages = []
+
+    def __call__(self, event, data):
+        with self._lock:
+            if event == "request":
+                stats = self.requests[data["operation"]]
+                stats["count"] += 1
+                stats["seconds"] += data["seconds"]
+                stats["bytes"] += data["bytes"]
+            elif event == "retry":
+                self.retries[data["reason"]]["count"] += 1
+                self.retries[data["reason"]]["wait_seconds"] += data["wait"]
+            elif event == "cache":
+                self.cache["hits" if data["hit"] else "misses"] += 1
+            elif event == "chunk":
+                self.chunk_calls.append(data["calls"])
+            elif event == "operation":
+                self.operations[data["operation"]]["count"] += 1
+                self.operations[data["operation"]]["seconds"] += data["seconds"]
+            elif event == "phase":
+                self.phases[data["phase"]] += data["seconds"]
+            elif event == "page":
+                self.pages.append(dict(data))
+
+    def __enter__(self):
+        add_hook(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        remove_hook(self)
+        self._end = time.perf_counter()
+
+    def summary(self):
+        """Returns the run's metrics as a dict of plain values, ready for json.dump.
+        Times added up over calls made in parallel, such as network time, can be more than the wall time."""
+        with self._lock:
+            end = self._end if self._end is not None else time.perf_counter()
+            requests = {
+                "count": sum(r["count"] for r in self.requests.values()),
+                "seconds": sum(r["seconds"] for r in self.requests.values()),
+                "bytes": sum(r["bytes"] for r in self.requests.values()),
+                "by_operation": {str(op): dict(r) for op, r in self.requests.items()},
+            }
+            return {
+                "wall_seconds": end - self._start,
+                "requests": requests,
+                "chunks": {
+                    "count": len(self.chunk_calls),
+                    "calls": sum(self.chunk_calls),
+                    "max_continue_chain": max(self.chunk_calls, default=0),
+                    "mean_continue_chain": sum(self.chunk_calls) / len(self.chunk_calls) if self.chunk_calls else 0,
+                },
+                "retries": {"count": sum(r["count"] for r in self.retries.values()),
+                            "by_reason": {reason: dict(r) for reason, r in self.retries.items()}},
+                "cache": dict(self.cache),
+                "phases": dict(self.phases, network=requests["seconds"]),
+                "operations": {op: dict(o) for op, o in self.operations.items()},
+                "pages": list(self.pages),
+            }
+
+
+class RateLimiter:
+    """Spaces out calls so no more than max_per_second start in any second, across all threads."""
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def reserve(self):
+        """Claims the next free slot, returning how many seconds to wait for it, for callers that can't block."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter shared by every process it's handed to, for sweeps run across a process pool.
+    The next free slot is kept in shared memory, so all of the processes together stay under max_per_second."""
+    def __init__(self, max_per_second):
+        self.interval = 1.0 / max_per_second if max_per_second else 0.0
+        self._next_slot = multiprocessing.Value("d", 0.0)
+
+    def reserve(self):
+        if not self.interval:
+            return 0.0
+        with self._next_slot.get_lock():
+            now = time.monotonic()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+        return slot - now
+
+
+class _SQLiteStore:
+    """Base of the on-disk SQLite stores. Holds one connection in WAL mode, shared by the worker threads with
+    every use under self._lock, and waiting up to SQLITE_TIMEOUT seconds for writes by other processes.
+    Subclasses create their tables from schema. A store is pickled as its settings, so a sweep process
+    it's sent to opens its own connection to the same file.
+    """
+    schema = ()
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.schema:
+            self._db.execute(statement)
+        self._db.commit()
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache(_SQLiteStore):
+    """On-disk SQLite store of API responses, keyed by the query that produced them.
+    Responses stored with a revision id are only returned while the caller still asks for that revision,
+    other responses expire after ttl seconds. Once more than max_entries responses are stored the least
+    recently used are evicted. When a response was last used is only written out on the next put or close,
+    so a hit is a read alone.
+
+    :param path: file to keep the cache in
+    :param ttl: seconds a response without a revision id stays fresh
+    :param max_entries: maximum number of responses kept
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY, response TEXT NOT NULL, revision INTEGER, stored REAL NOT NULL,
+            used REAL NOT NULL)""",
+        "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)",
+    )
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=DEFAULT_CACHE_TTL, max_entries=DEFAULT_CACHE_SIZE):
+        super().__init__(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # {key: time} of hits not yet written to the used column
+        self._used = {}
+
+    def __getstate__(self):
+        return {"path": self.path, "ttl": self.ttl, "max_entries": self.max_entries}
+
+    @staticmethod
+    def key(params):
+        return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+    def get(self, params, revision=None, fresh_only=True):
+        """Returns the stored response to the query params, or None if there isn't a usable one.
+
+        :param revision: revision id the response must have been stored with
+        :param fresh_only: if False return whatever is stored, ignoring revision and ttl
+        """
+        key = self.key(params)
+        with self._lock:
+            row = self._db.execute("SELECT response, revision, stored FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            response, stored_revision, stored = row
+            if fresh_only:
+                if revision is not None and stored_revision != revision:
+                    return None
+                if revision is None and (stored_revision is not None or time.time() - stored > self.ttl):
+                    return None
+            self._used[key] = time.time()
+        return json.loads(response)
+
+    def put(self, params, response, revision=None):
+        """Stores the response to the query params, evicting the least recently used responses if over size."""
+        now = time.time()
+        with self._lock:
+            self._write_used()
+            self._db.execute("INSERT OR REPLACE INTO responses (key, response, revision, stored, used) "
+                             "VALUES (?, ?, ?, ?, ?)",
+                             (self.key(params), json.dumps(response, separators=(",", ":")), revision, now, now))
+            self._db.execute("DELETE FROM responses WHERE key IN "
+                             "(SELECT key FROM responses ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _write_used(self):
+        """Writes out when responses were last used, under self._lock. The caller commits."""
+        if self._used:
+            self._db.executemany("UPDATE responses SET used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+
+    def close(self):
+        with self._lock:
+            self._write_used()
+            self._db.commit()
+            self._db.close()
+
+
+class WatermarkStore(_SQLiteStore):
+    """On-disk SQLite record of what each listed article's talk page looked like when it was last checked.
+    Holds, per title as listed, the talk page's latest revision id, the title it resolved to and the
+    assessments found, so later runs only need fresh assessments for articles whose talk page has changed.
+
+    :param path: file to keep the watermarks in
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS watermarks (
+            title TEXT PRIMARY KEY, talk_revision INTEGER, resolved TEXT NOT NULL, assessments TEXT,
+            checked REAL NOT NULL)""",
+    )
+
+    def __init__(self, path=DEFAULT_STATE_FILE):
+        super().__init__(path)
+
+    def get(self, article_titles):
+        """Returns {"listed_title": (talk_revision, "resolved_title", [assessments] or None)} for stored titles."""
+        results = {}
+        with self._lock:
+            for i in range(0, len(article_titles), 500):
+                chunk = article_titles[i:i + 500]
+                rows = self._db.execute("SELECT title, talk_revision, resolved, assessments FROM watermarks "
+                                        "WHERE title IN ({})".format(",".join("?" * len(chunk))), chunk)
+                for title, talk_revision, resolved, assessments in rows:
+                    results[title] = (talk_revision, resolved, json.loads(assessments) if assessments else None)
+        return results
+
+    def put(self, watermarks):
+        """Stores {"listed_title": (talk_revision, "resolved_title", [assessments] or None)}."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?, ?, ?)", [
+                (title, talk_revision, resolved, json.dumps(assessments) if assessments is not None else None, now)
+                for title, (talk_revision, resolved, assessments) in watermarks.items()])
+            self._db.commit()
+
+
+class Checkpoint(_SQLiteStore):
+    """On-disk SQLite record of a run's progress, saved after every chunk and every page checked,
+    so an interrupted run can be resumed where it stopped.
+    Chunks are only reused while the page's content is the same as when they were saved.
+
+    :param path: file to keep the checkpoint in
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS chunks (
+            page TEXT NOT NULL, content TEXT NOT NULL, chunk INTEGER NOT NULL, result TEXT NOT NULL,
+            PRIMARY KEY (page, content, chunk))""",
+        "CREATE TABLE IF NOT EXISTS pages (page TEXT PRIMARY KEY, mismatches TEXT NOT NULL)",
+    )
+
+    def __init__(self, path=DEFAULT_CHECKPOINT_FILE):
+        super().__init__(path)
+
+    @staticmethod
+    def content_key(content):
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def chunks(self, page, content_key):
+        """Returns {chunk index: ChunkResult} of the chunks saved for this page and content.
+        Their listings are empty, as listings aren't saved."""
+        with self._lock:
+            rows = self._db.execute("SELECT chunk, result FROM chunks WHERE page = ? AND content = ?",
+                                    (page, content_key)).fetchall()
+        return {index: ChunkResult([], **json.loads(result)) for index, result in rows}
+
+    def save_chunk(self, page, content_key, index, chunk):
+        result = json.dumps({"assessments": chunk.assessments, "redirects": chunk.redirects,
+                             "mismatches": chunk.mismatches, "changed": chunk.changed, "former": chunk.former})
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", (page, content_key, index, result))
+            self._db.commit()
+
+    def page(self, page):
+        """Returns the mismatches saved for a finished page, or None if it hasn't been finished."""
+        with self._lock:
+            row = self._db.execute("SELECT mismatches FROM pages WHERE page = ?", (page,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_page(self, page, mismatches):
+        """Saves a finished page's mismatches. Its chunks are no longer needed."""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?)", (page, json.dumps(mismatches)))
+            self._db.execute("DELETE FROM chunks WHERE page = ?", (page,))
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("DELETE FROM pages")
+            self._db.commit()
+
+
+class ResultsStore(_SQLiteStore):
+    """On-disk SQLite record of every run's results: the listings checked, with their listed class and current
+    assessments, and the mismatches found, under the run's date. Mismatches are keyed by run, page and title,
+    so comparing two runs is a matter of indexed lookups however many titles they checked.
+
+    :param path: file to keep the results in
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS runs (
+            run INTEGER PRIMARY KEY, date TEXT NOT NULL, accuracy REAL)""",
+        """CREATE TABLE IF NOT EXISTS pages (
+            run INTEGER NOT NULL, page TEXT NOT NULL, PRIMARY KEY (run, page))""",
+        """CREATE TABLE IF NOT EXISTS listings (
+            run INTEGER NOT NULL, page TEXT NOT NULL, title TEXT NOT NULL, listed_as TEXT NOT NULL, history TEXT,
+            section INTEGER, current TEXT, PRIMARY KEY (run, page, title))""",
+        """CREATE TABLE IF NOT EXISTS mismatches (
+            run INTEGER NOT NULL, page TEXT NOT NULL, title TEXT NOT NULL, listed_as TEXT NOT NULL, current TEXT,
+            PRIMARY KEY (run, page, title))""",
+        """CREATE TABLE IF NOT EXISTS former_mismatches (
+            run INTEGER NOT NULL, page TEXT NOT NULL, title TEXT NOT NULL, marked TEXT NOT NULL, former TEXT NOT NULL,
+            PRIMARY KEY (run, page, title))""",
+    )
+
+    def __init__(self, path=DEFAULT_RESULTS_FILE, run=None):
+        super().__init__(path)
+        self.run = run
+
+    def __getstate__(self):
+        return {"path": self.path, "run": self.run}
+
+    def start_run(self, accuracy=None, date=None):
+        """Starts a new run, which results are saved under from then on. Returns its id."""
+        date = date or time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock:
+            self.run = self._db.execute("INSERT INTO runs (date, accuracy) VALUES (?, ?)", (date, accuracy)).lastrowid
+            self._db.commit()
+        return self.run
+
+    def runs(self):
+        """Returns [(run, date)] of every run, oldest first."""
+        with self._lock:
+            return self._db.execute("SELECT run, date FROM runs ORDER BY run").fetchall()
+
+    def save_chunk(self, page, chunk):
+        """Saves a ChunkResult's listings, mismatches and any former status mismatches, from the page with this key,
+        to the current run."""
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO pages VALUES (?, ?)", (self.run, page))
+            self._db.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                (self.run, page, l.title, l.assessment, l.history, l.section,
+                 json.dumps(chunk.assessments[l.title]) if l.title in chunk.assessments else None)
+                for l in map(_as_listing, chunk.listings)])
+            self._db.executemany("INSERT OR REPLACE INTO mismatches VALUES (?, ?, ?, ?, ?)", [
+                (self.run, page, m["title"], m["listed_as"], json.dumps(m["current"]) if m["current"] else None)
+                for m in chunk.mismatches])
+            self._db.executemany("INSERT OR REPLACE INTO former_mismatches VALUES (?, ?, ?, ?, ?)", [
+                (self.run, page, m["title"], json.dumps(m["marked"]), json.dumps(m["former"]))
+                for m in chunk.former or []])
+            self._db.commit()
+
+    def mismatches(self, run=None):
+        """Returns the mismatches of a run, the current one by default, as dicts with their page."""
+        return self._mismatches("SELECT page, title, listed_as, current FROM mismatches WHERE run = ? "
+                                "ORDER BY page, title", (run or self.run,))
+
+    def former_mismatches(self, run=None):
+        """Returns the former status mismatches of a run, the current one by default, as dicts with their page."""
+        with self._lock:
+            rows = self._db.execute("SELECT page, title, marked, former FROM former_mismatches WHERE run = ? "
+                                    "ORDER BY page, title", (run or self.run,)).fetchall()
+        return [{"page": page, "title": title, "marked": json.loads(marked), "former": json.loads(former)}
+                for page, title, marked, former in rows]
+
+    def diff(self, run=None, previous=None):
+        """Compares the mismatches of run, by default the current one, with those of an earlier run, by default
+        the one before it. Mismatches are the same if they are of the same title on the same page.
+        Only mismatches on pages checked in run can have been resolved.
+
+        :return: {"new": [mismatches], "resolved": [mismatches], "unchanged": [mismatches]}, with the current
+            assessments as of run, or of previous for resolved ones
+        """
+        run = run or self.run
+        if previous is None:
+            with self._lock:
+                row = self._db.execute("SELECT MAX(run) FROM runs WHERE run < ?", (run,)).fetchone()
+            previous = row[0]
+        return {
+            "new": self._mismatches(
+                "SELECT page, title, listed_as, current FROM mismatches m WHERE run = ? AND NOT EXISTS "
+                "(SELECT 1 FROM mismatches WHERE run = ? AND page = m.page AND title = m.title) ORDER BY page, title",
+                (run, previous)),
+            "resolved": self._mismatches(
+                "SELECT page, title, listed_as, current FROM mismatches m WHERE run = ? "
+                "AND EXISTS (SELECT 1 FROM pages WHERE run = ? AND page = m.page) AND NOT EXISTS "
+                "(SELECT 1 FROM mismatches WHERE run = ? AND page = m.page AND title = m.title) ORDER BY page, title",
+                (previous, run, run)),
+            "unchanged": self._mismatches(
+                "SELECT page, title, listed_as, current FROM mismatches m WHERE run = ? AND EXISTS "
+                "(SELECT 1 FROM mismatches WHERE run = ? AND page = m.page AND title = m.title) ORDER BY page, title",
+                (run, previous)),
+        }
+
+    def _mismatches(self, sql, args):
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [{"page": page, "title": title, "listed_as": listed_as,
+                 "current": json.loads(current) if current else None} for page, title, listed_as, current in rows]
+
+    def export(self, path, run=None, listings=False, former=False):
+        """Writes a run's mismatches, or all of its listings, with the run's date to path, as CSV if it ends in
+        .csv and otherwise as JSON lines. Current assessments are joined with spaces in CSV.
+        With former, the run's former status mismatches are written after the mismatches, with the icons
+        they are marked with and the article's former statuses in marked and former columns. Returns the
+        number of rows written."""
+        run = run or self.run
+        table = "listings" if listings else "mismatches"
+        columns = ["page", "title", "listed_as"] + (["history", "section"] if listings else []) + ["current"]
+        former_columns = ["marked", "former"] if former and not listings else []
+        with self._lock:
+            date = self._db.execute("SELECT date FROM runs WHERE run = ?", (run,)).fetchone()[0]
+            rows = self._db.execute("SELECT {} FROM {} WHERE run = ? ORDER BY page, title".format(
+                ", ".join(columns), table), (run,)).fetchall()
+        former_rows = self.former_mismatches(run) if former_columns else []
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            if path.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["date"] + columns + former_columns)
+                for row in rows:
+                    current = json.loads(row[-1]) if row[-1] else []
+                    writer.writerow([date] + list(row[:-1]) + [" ".join(current)] + [""] * len(former_columns))
+                for m in former_rows:
+                    writer.writerow([date, m["page"], m["title"], "", "", " ".join(m["marked"]),
+                                     " ".join(m["former"])])
+            else:
+                for row in rows:
+                    record = dict({"date": date}, **dict(zip(columns, row)))
+                    record["current"] = json.loads(row[-1]) if row[-1] else None
+                    f.write(json.dumps(record) + "\n")
+                for m in former_rows:
+                    f.write(json.dumps(dict({"date": date}, **m)) + "\n")
+        return len(rows) + len(former_rows)
+
+
+class ApiClient:
+    """Client shared by every call to the Wikipedia API.
+    Holds a single pooled, keep-alive session so each query reuses an open connection rather than
+    paying for a new TCP and TLS handshake, and sets the User-Agent and gzip headers in one place.
+    Also enforces API etiquette for every thread using it: at most `workers` requests in flight,
+    at most `max_rps` requests started per second, and the maxlag parameter on every query.
+    Failed requests, from network errors, overloaded servers or maxlag, are retried with exponential backoff,
+    waiting at least as long as the server's Retry-After header asks.
+    The async API runs its calls on the client's own thread pool, of `workers` threads, see run.
+
+    :param api_url: API endpoint to query
+    :param user_agent: User-Agent header sent with every request
+    :param transport: optional object with a requests-style get(url, params, headers=..., timeout=...) method
+        returning a response with .json(). Defaults to a pooled requests.Session; pass a stand-in for tests or
+        offline runs.
+    :param pool_size: maximum number of connections kept open to the API host
+    :param workers: maximum number of requests in flight at once, also the default batch_query concurrency
+    :param max_rps: maximum requests started per second, None for no limit
+    :param maxlag: seconds of database replication lag at which the API should refuse us, None to not send it
+    :param max_retries: how many times to retry a failed request before giving up
+    :param backoff: seconds to wait before the first retry, doubling for each one after
+    :param max_backoff: most seconds to wait between retries, unless the server asks for longer
+    :param timeout: seconds to wait for the API to respond
+    :param cache: optional ResponseCache to answer queries from and store responses in
+    :param offline: only answer queries from the cache, never contacting the API
+    :param rate_limiter: optional RateLimiter shared with other clients, used instead of one for max_rps
+    """
+    def __init__(self, api_url=API_URL, user_agent=USER_AGENT, transport=None, pool_size=10,
+                 workers=DEFAULT_WORKERS, max_rps=DEFAULT_MAX_RPS, maxlag=DEFAULT_MAXLAG, max_retries=DEFAULT_RETRIES,
+                 backoff=1.0, max_backoff=60.0, timeout=DEFAULT_TIMEOUT, cache=None, offline=False, rate_limiter=None):
+        if offline and cache is None:
+            raise ValueError("An offline ApiClient needs a cache to answer queries from")
+        self.api_url = api_url
+        self.headers = {"User-Agent": user_agent, "Accept-Encoding": "gzip, deflate"}
+        if transport is None:
+            transport = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, workers))
+            transport.mount("https://", adapter)
+            transport.mount("http://", adapter)
+        self.transport = transport
+        self.workers = max(1, workers)
+        self.maxlag = maxlag
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter(max_rps)
+        self._in_flight = threading.BoundedSemaphore(self.workers)
+        self.cache = cache
+        self.offline = offline
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self):
+        """Thread pool of `workers` threads the async API runs its calls on, started when first needed."""
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers,
+                                                                       thread_name_prefix="ApiClient")
+            return self._executor
+
+    async def run(self, func, *args, rate_limited=True):
+        """Runs func(*args) on the client's executor from an event loop, returning its result.
+        With rate_limited, the rate limit slot for the first request func makes is waited for here with
+        asyncio.sleep, so no worker thread is held waiting. Any further requests it makes, for continuations or
+        retries, wait in the worker thread as usual. Clients with a cache leave every wait to the worker thread,
+        as a query answered from the cache needs no slot.
+        """
+        context = contextvars.copy_context()
+        if rate_limited and self.cache is None:
+            delay = self.rate_limiter.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            context.run(_reserved_slot.set, self.rate_limiter)
+        return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                functools.partial(context.run, func, *args))
+
+    def query(self, params, revision=None, cached=True):
+        """Makes one API request and returns the decoded json response.
+        Waits and retries if the request fails or the servers are lagged, as asked for by the maxlag parameter.
+
+        :param revision: revision id the response reflects, so a cached copy is only used while it is current.
+            Without one a cached copy is used until it is older than the cache's ttl.
+        :param cached: whether the cache may answer this query and store its response
+        """
+        cached = cached and self.cache is not None
+        if cached:
+            r = self.cache.get(params, revision=revision, fresh_only=not self.offline)
+            emit("cache", operation=_operation.get(), hit=r is not None)
+            if r is not None:
+                return r
+        if self.offline:
+            raise LookupError("Running offline and no cached response for {}".format(params))
+        r = self._fetch(params)
+        if cached and "error" not in r:
+            self.cache.put(params, r, revision)
+        return r
+
+    def _fetch(self, params):
+        if self.maxlag is not None:
+            params = dict(params, maxlag=self.maxlag)
+        attempt = 0
+        while True:
+            resp = r = error = None
+            if _reserved_slot.get() is self.rate_limiter:
+                _reserved_slot.set(None)
+            else:
+                self.rate_limiter.wait()
+            with self._in_flight:
+                start = time.perf_counter()
+                try:
+                    resp = self.transport.get(self.api_url, params, headers=self.headers, timeout=self.timeout)
+                    status = getattr(resp, "status_code", 200)
+                    if isinstance(status, int) and status >= 400:
+                        raise requests.HTTPError("HTTP {} from {}".format(status, self.api_url), response=resp)
+                    r = resp.json()
+                except (requests.RequestException, ValueError) as e:
+                    error = e
+                content = getattr(resp, "content", None)
+                emit("request", operation=_operation.get(), seconds=time.perf_counter() - start, attempt=attempt,
+                     bytes=len(content) if isinstance(content, (bytes, str)) else 0)
+            if error is None:
+                reason = r.get("error", {}).get("code")
+                if reason not in RETRY_ERRORS:
+                    return r
+            elif isinstance(error, requests.HTTPError) and error.response is not None and \
+                    getattr(error.response, "status_code", None) not in RETRY_STATUSES:
+                raise error
+            else:
+                reason = type(error).__name__
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return r
+            wait = max(_retry_after(resp, 0.0), min(self.backoff * 2 ** attempt, self.max_backoff))
+            attempt += 1
+            emit("retry", operation=_operation.get(), reason=reason, wait=wait)
+            time.sleep(wait)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+        if hasattr(self.transport, "close"):
+            self.transport.close()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _retry_after(resp, default=5.0):
+    """Seconds the server asked us to wait before retrying, from the Retry-After header."""
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+
+_default_client = None
+
+
+def get_client():
+    """Returns the module wide ApiClient, creating it on first use."""
+    global _default_client
+    if _default_client is None:
+        _default_client = ApiClient()
+    return _default_client
+
+
+def set_client(client):
+    """Replaces the module wide ApiClient, e.g. with one using a different transport. Returns the previous client."""
+    global _default_client
+    previous = _default_client
+    _default_client = client
+    return previous
+
+
+# Assessment classes, https://en.wikipedia.org/wiki/Wikipedia:Content_assessment. Each is given a small integer
+# code, "" (no class given) being 0. Classes not listed here are given the next free code when first seen.
+ASSESSMENT_CLASSES = ("", "fa", "a", "ga", "b", "c", "start", "stub", "fl", "al", "bl", "cl", "list", "sia",
+                      "future", "current", "dab", "disambig", "redirect", "template", "category", "project", "na")
+_class_codes = {name: code for code, name in enumerate(ASSESSMENT_CLASSES)}
+_class_names = list(ASSESSMENT_CLASSES)
+_class_lock = threading.Lock()
+
+
+def class_code(name):
+    """Returns the integer code for an assessment class, ignoring case."""
+    try:
+        return _class_codes[name]
+    except KeyError:
+        pass
+    with _class_lock:
+        canonical = name.lower()
+        if canonical not in _class_codes:
+            _class_codes[canonical] = len(_class_names)
+            _class_names.append(canonical)
+        # remember this spelling too, so next time it's a single lookup
+        _class_codes[name] = _class_codes[canonical]
+        return _class_codes[name]
+
+
+def class_name(code):
+    """Returns the lower case assessment class for a code from class_code."""
+    return _class_names[code]
+
+
+class Listing:
+    """One article listing from a page, stored compactly: no per instance dict, the listed assessment and
+    history icons interned so every "B" or "DGA" is the same string, and the assessment's class code kept
+    for comparisons. Reads like the dicts parse_article returns, listing["title"], and as_dict() gives one.
+    """
+    __slots__ = ("title", "assessment", "history", "code", "section")
+
+    def __init__(self, title, assessment, history=None, section=0):
+        self.title = title
+        self.assessment = sys.intern(assessment)
+        self.history = sys.intern(history) if history else None
+        self.code = _class_codes.get(assessment) or class_code(assessment)
+        self.section = section
+
+    @classmethod
+    def from_dict(cls, listing):
+        return cls(listing["title"], listing["assessment"], listing["history"])
+
+    def as_dict(self):
+        return {"title": self.title, "assessment": self.assessment, "history": self.history}
+
+    def __reduce__(self):
+        # codes of classes outside ASSESSMENT_CLASSES differ between processes, so the code is worked out again
+        return Listing, (self.title, self.assessment, self.history, self.section)
+
+    def __getitem__(self, key):
+        if key not in ("title", "assessment", "history"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __eq__(self, other):
+        return isinstance(other, Listing) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return "Listing({!r}, {!r}, {!r})".format(self.title, self.assessment, self.history)
+
+
+def _as_listing(listing):
+    return listing if isinstance(listing, Listing) else Listing.from_dict(listing)
+
+
+# former is the chunk's find_former_mismatches, or None if former statuses weren't checked
+ChunkResult = collections.namedtuple("ChunkResult", ["listings", "assessments", "redirects", "mismatches", "changed",
+                                                     "former"], defaults=[None])
+
+
+@_instrument
+def article_list_assessment_check(article_title, section=None, accuracy=.01, client=None, log=print, store=None,
+                                  on_chunk=None, checkpoint=None, links=False, results_store=None, counts=False,
+                                  former=False, content=None, results_page=None):
     """Given a Wikipedia page listing articles, compares listed article
     quality assessments to actual current assessment.
     :param article_title: Wikipedia page containing a list of articles and their assessments
     :param section: optional sub section of above page.
     :param accuracy: minimum ratio of assessments to qualify as a mismatch
-    :return: List containing all mismatched articles.
-    """
-    content = get_content(article_title, section)
-    # probably should refactor so parse_articles returns a dictionary, not a list...
-    listings = parse_article(content)
-    print("Looking at {}. Checking {} articles.".format(article_title, len(listings)))
-    redirects = find_redirects([l["title"] for l in listings])
-    if len(redirects):
-        print("Found {} redirects".format(len(redirects)))
-    for listing in listings:
-        if listing["title"] in redirects:
-            print("{} redirects to {}".format(listing["title"], redirects[listing["title"]]))
-            listing["title"] = redirects[listing["title"]]
-    assessments = current_assessments([l["title"] for l in listings])
-    mismatches = find_mismatches(listings, assessments, accuracy)
-
-    for m in mismatches:
-        if m["current"]:
-            print("Mismatch found! {} listed as {}, currently {}".format(m["title"], m["listed_as"], m["current"]))
+    :param client: optional ApiClient, defaults to the module wide client
+    :param log: function called with each line of progress output, print by default
+    :param store: optional WatermarkStore; if given only articles whose talk page changed since the
+        last run have their assessments fetched again
+    :param on_chunk: optional function called with the ChunkResult of every chunk checked
+    :param checkpoint: optional Checkpoint to save each chunk to once checked, and to take any chunks
+        already checked from
+    :param links: get the assessments of every article the page links to with linked_assessments, rather than
+        querying the listed titles 50 at a time. The wikitext is then only needed for the listed classes.
+        Ignored if store or section is given, as the links of the whole page would be fetched for each section.
+    :param results_store: optional ResultsStore to save the listings and mismatches to, under its current run
+    :param results_page: page to save them under in results_store, by default the title, with "#section" if a
+        section is given. Only results saved under the same page can be compared by ResultsStore.diff.
+    :param counts: also report sections whose heading gives a different number of articles than they list,
+        from the same content
+    :param former: also report listings whose history icons, such as FFA or DGA, don't match the article's
+        former statuses, see find_former_mismatches. These are returned after the other mismatches, and are
+        told apart by their "marked" and "former" keys.
+    :param content: optional wikitext of the whole page, already fetched, to check instead of fetching it again.
+        The section is picked out of it.
+    :return: List containing all mismatched articles, followed by any former status mismatches.
+    """
+    start = time.perf_counter()
+    client = client or get_client()
+    section_index = None
+    # the whole page is cached while it's unchanged, so pick the section out of that instead of fetching it
+    whole_page = bool(section) and (content is not None or client.cache is not None)
+    if whole_page:
+        if content is None:
+            content = get_content(article_title, client=client)
+        with _phase("parse"):
+            section_index = SectionIndex(content)
+        listings = section_index.section_listings(int(section))
+    else:
+        if content is None:
+            content = get_content(article_title, section, client=client)
+        if counts:
+            with _phase("parse"):
+                section_index = SectionIndex(content)
+            listings = section_index.listings
         else:
-            print("{} has no assessments! Possible issue with WikiProject or talk page?".format(m["title"]))
-    print("{} mismatches found.".format(len(mismatches)))
-    return mismatches
+            listings = iter_listings(content)
+    log("Looking at {}.".format(article_title))
+    if counts:
+        # the index is of the whole page if the section was picked out of it, else of what was fetched
+        for d in section_index.count_discrepancies(section if whole_page else None):
+            log("Section \"{}\" says it lists {} articles, but lists {}.".format(d["heading"], d["listed"],
+                                                                             d["counted"]))
+    linked = linked_assessments(article_title, client=client) if links and store is None and not section else None
+    statuses = former_statuses(client) if former else None
+    done = {}
+    if checkpoint is not None:
+        page, content_key = _page_key(article_title, section), Checkpoint.content_key(content)
+        done = checkpoint.chunks(page, content_key)
+        if done:
+            log("Resuming, {} chunks already checked.".format(len(done)))
+    mismatches = []
+    former_mismatches = []
+    num_listings = num_redirects = num_changed = 0
+    # results are reported chunk by chunk, while later chunks are still being parsed and queried
+    for index, chunk in enumerate(check_listings(listings, accuracy, client=client, store=store, done=done,
+                                                 linked=linked, former=statuses)):
+        if checkpoint is not None and index not in done:
+            checkpoint.save_chunk(page, content_key, index, chunk)
+        if results_store is not None:
+            results_store.save_chunk(results_page or _page_key(article_title, section), chunk)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        num_listings += len(chunk.listings)
+        num_redirects += len(chunk.redirects)
+        num_changed += len(chunk.changed or [])
+        for listed_title, resolved_title in chunk.redirects.items():
+            log("{} redirects to {}".format(listed_title, resolved_title))
+        for m in chunk.mismatches:
+            if m["current"]:
+                log("Mismatch found! {} listed as {}, currently {}".format(m["title"], m["listed_as"], m["current"]))
+            else:
+                log("{} has no assessments! Possible issue with WikiProject or talk page?".format(m["title"]))
+        mismatches.extend(chunk.mismatches)
+        for m in chunk.former or []:
+            log("Former status mismatch! {} marked as {}, currently {}".format(
+                m["title"], " ".join(m["marked"]) or "no former status", " ".join(m["former"]) or "none"))
+        former_mismatches.extend(chunk.former or [])
+    log("Checked {} articles, found {} redirects.".format(num_listings, num_redirects))
+    if store is not None:
+        log("{} articles changed since the last run.".format(num_changed))
+    log("{} mismatches found.".format(len(mismatches)))
+    if statuses is not None:
+        log("{} former status mismatches found.".format(len(former_mismatches)))
+    emit("page", title=article_title, listings=num_listings, mismatches=len(mismatches),
+         seconds=time.perf_counter() - start)
+    return mismatches + former_mismatches
+
+
+def _page_key(article_title, section=None):
+    return "{}#{}".format(article_title, section) if section else article_title
+
+
+def check_listings(listings, accuracy=.01, client=None, store=None, chunk_size=50, done=None, linked=None,
+                   former=None):
+    """Pipeline checking a stream of listings, such as from iter_listings, against current assessments.
+    Listings are grouped into chunks of chunk_size as they arrive, and each chunk's query is started as soon
+    as it fills, with up to the client's workers chunks in flight. Listings in each chunk are renamed to
+    the title they redirect to.
+
+    :param listings: iterable of listings as generated by iter_listings
+    :param accuracy: minimum ratio of assessments to qualify as a mismatch
+    :param client: optional ApiClient, defaults to the module wide client
+    :param store: optional WatermarkStore, see article_list_assessment_check
+    :param done: optional {chunk index: ChunkResult} of chunks already checked, which are passed on as they are
+        rather than queried again, with this run's listings filled in
+    :param linked: optional result of linked_assessments for the page the listings are from. Only listings it
+        doesn't cover are queried.
+    :param former: optional result of former_statuses, to check each chunk's history icons against
+    :return: generator of ChunkResult(listings, assessments, redirects, mismatches, changed, former) in listing
+        order, changed being None unless store is given and former None unless former is
+    """
+    client = client or get_client()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=client.workers) as executor:
+        pending = collections.deque()
+        # listings are parsed as they're pulled into chunks, so that time counts as parsing
+        for index, chunk in enumerate(_timed_iter(iter_chunks(listings, chunk_size), "parse")):
+            if done and index in done:
+                pending.append(_completed(_restore_chunk(chunk, done[index], former)))
+            else:
+                pending.append(executor.submit(_in_context(_check_chunk), chunk, accuracy, client, store,
+                                               linked, former))
+            if len(pending) >= client.workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def stream_mismatches(listings, accuracy=.01, client=None, store=None):
+    """Generator of mismatches from check_listings, yielded as soon as their chunk has been checked."""
+    for chunk in check_listings(listings, accuracy, client=client, store=store):
+        yield from chunk.mismatches
+
+
+async def async_get_content(article_title, section=None, client=None):
+    """Async version of get_content. Like the rest of the async API, the request is made on the ApiClient's
+    own worker threads with ApiClient.run, so every check on the event loop shares its connection pool,
+    rate limit and in-flight limit, and waits for the rate limit on the event loop."""
+    client = client or get_client()
+    return await client.run(functools.partial(get_content, article_title, section, client=client))
+
+
+async def async_current_assessments_with_redirects(article_titles, client=None):
+    """Async version of current_assessments_with_redirects, querying every chunk of 50 titles at once."""
+    client = client or get_client()
+    chunks = [article_titles[i:i + 50] for i in range(0, len(article_titles), 50)]
+    assessments, redirects = {}, {}
+    for chunk_assessments, chunk_redirects in await asyncio.gather(*[
+            client.run(functools.partial(current_assessments_with_redirects, chunk, client=client))
+            for chunk in chunks]):
+        assessments.update(chunk_assessments)
+        redirects.update(chunk_redirects)
+    return assessments, redirects
+
+
+async def async_check_listings(listings, accuracy=.01, client=None, store=None, chunk_size=50, linked=None,
+                               former=None):
+    """Async generator version of check_listings, yielding a ChunkResult for each chunk in listing order,
+    with up to the client's workers chunks being checked at once. Listings are pulled from listings as chunks
+    are needed, so a generator such as iter_listings is parsed as the check goes, on the client's executor
+    rather than on the event loop."""
+    client = client or get_client()
+    pending = collections.deque()
+    chunks = iter_chunks(listings, chunk_size)
+    while True:
+        chunk = await client.run(next, chunks, None, rate_limited=False)
+        if chunk is None:
+            break
+        pending.append(asyncio.ensure_future(client.run(_check_chunk, chunk, accuracy, client, store, linked,
+                                                        former)))
+        if len(pending) >= client.workers:
+            yield await pending.popleft()
+    while pending:
+        yield await pending.popleft()
+
+
+async def async_article_list_assessment_check(article_title, section=None, accuracy=.01, client=None, store=None,
+                                              on_chunk=None, links=False, results_store=None, former=False):
+    """Async generator version of article_list_assessment_check, for services checking many pages, or wikis,
+    concurrently on one event loop. Yields each mismatch as soon as the chunk it is in has been checked,
+    and logs nothing. With former, each chunk's former status mismatches are yielded after its other ones.
+    See article_list_assessment_check for the parameters. There is no counts, since its results are only
+    logged; call SectionIndex.count_discrepancies on the content instead. There is no checkpoint either.
+    """
+    start = time.perf_counter()
+    client = client or get_client()
+    if section and client.cache is not None:
+        content = await async_get_content(article_title, client=client)
+        listings = await client.run(lambda: SectionIndex(content).section_listings(int(section)), rate_limited=False)
+    else:
+        content = await async_get_content(article_title, section, client=client)
+        listings = iter_listings(content)
+    linked = None
+    if links and store is None and not section:
+        linked = await client.run(functools.partial(linked_assessments, article_title, client=client))
+    statuses = await client.run(former_statuses, client) if former else None
+    num_listings = num_mismatches = 0
+    async for chunk in async_check_listings(listings, accuracy, client=client, store=store, linked=linked,
+                                            former=statuses):
+        if results_store is not None:
+            await client.run(results_store.save_chunk, _page_key(article_title, section), chunk, rate_limited=False)
+        if on_chunk is not None:
+            on_chunk(chunk)
+        num_listings += len(chunk.listings)
+        num_mismatches += len(chunk.mismatches)
+        for m in chunk.mismatches + (chunk.former or []):
+            yield m
+    emit("page", title=article_title, listings=num_listings, mismatches=num_mismatches,
+         seconds=time.perf_counter() - start)
+
+
+def _completed(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def _restore_chunk(listings, result, former=None):
+    listings = [_as_listing(l) for l in listings]
+    for listing in listings:
+        listing.title = result.redirects.get(listing.title, listing.title)
+    # checked again, as the chunk may have been saved by a run that didn't check them
+    return result._replace(listings=listings,
+                           former=find_former_mismatches(listings, former) if former is not None else None)
+
+
+def _check_chunk(listings, accuracy, client, store, linked=None, former=None):
+    listings = [_as_listing(l) for l in listings]
+    titles = [l.title for l in listings]
+    changed = None
+    if store is not None:
+        assessments, redirects, changed = current_assessments_incremental(titles, store, client=client)
+    elif linked is not None:
+        assessments, redirects = _from_linked(titles, linked, client)
+    else:
+        assessments, redirects = current_assessments_with_redirects(titles, client=client)
+    for listing in listings:
+        if listing.title in redirects:
+            listing.title = redirects[listing.title]
+    with _phase("analysis"):
+        mismatches = find_mismatches(listings, assessments, accuracy)
+        former_mismatches = find_former_mismatches(listings, former) if former is not None else None
+    return ChunkResult(listings, assessments, redirects, mismatches, changed, former_mismatches)
+
+
+@contextlib.contextmanager
+def _phase(phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit("phase", phase=phase, seconds=time.perf_counter() - start)
+
+
+def _timed_iter(iterable, phase):
+    """Passes on the items of iterable, emitting the time spent waiting for each as a phase event."""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            emit("phase", phase=phase, seconds=time.perf_counter() - start)
+        yield item
 
 
-def get_content(article_title, section=None):
+def iter_chunks(iterable, chunk_size=50):
+    """Groups any iterable into lists of up to chunk_size items, without reading further ahead than that."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@_instrument
+def get_content(article_title, section=None, client=None):
     """Returns the content of a Wikipedia article, or optional section of an article."""
-    baseurl = "https://en.wikipedia.org/w/api.php"
+    client = client or get_client()
     query_attrs = {
         "action": "query",
         "titles": article_title,
@@ -79,14 +1174,54 @@ def get_content(article_title, section=None):
     }
     if section:
         query_attrs["rvsection"] = section
-    resp = requests.get(baseurl, query_attrs, headers={"User-Agent": USER_AGENT})
-    pages = resp.json()["query"]["pages"]
+    revision = None
+    if client.cache is not None and not client.offline:
+        # a cheap look at the latest revision id decides whether a cached copy of the text is still good
+        revision = last_revision(article_title, client)
+    pages = client.query(query_attrs, revision=revision)["query"]["pages"]
     # only one page is queried, so return the first page's first revision text, or None if we didn't get anything.
     for p_key, p_val in pages.items():
         return p_val["revisions"][0]["*"]
     return None
 
 
+@_instrument
+def last_revision(article_title, client=None):
+    """Returns the id of the latest revision of a Wikipedia article, or None if it doesn't exist."""
+    client = client or get_client()
+    query_attrs = {
+        "action": "query",
+        "titles": article_title,
+        "prop": "info",
+        "format": "json"
+    }
+    pages = client.query(query_attrs, cached=False)["query"]["pages"]
+    for p_key, p_val in pages.items():
+        return p_val.get("lastrevid")
+    return None
+
+
+# An article listing. Captures just the parts kept: the assessment, any history icons and the title
+ARTICLE_LISTING_REGEX = re.compile(r'''
+    [*#]\s*                                         # line starts with a bullet or a number
+    \{\{[Ii]con\|(\w+)\}\}                          # assessment should always be first
+    ((?:\s*\{\{[Ii]con\|\w+\}\})*)                  # option of multiple icons for FFA, or DGA
+    \s*
+    \'*\[\[([^#<>\[\]|]+)(?:\]\]|\|[^#<>\[\]]*\]\])    # actual title is a wikilink, maybe piped
+''', re.VERBOSE)
+HISTORY_ICON_REGEX = re.compile(r"\{\{[Ii]con\|(\w+)\}\}")
+# A section header, alone on its line
+HEADER_REGEX = re.compile(r"(={1,6})([^\n]+?)\1[ \t]*$", re.MULTILINE)
+# number of articles a heading says its section lists, e.g. "People (2,000 articles)" or "Writers (95/100 articles)"
+SECTION_COUNT_REGEX = re.compile(r"\((\d[\d,]*)(?:\s*/\s*[\d,]+)?\s+articles?\)", re.IGNORECASE)
+
+Section = collections.namedtuple("Section", ["index", "level", "heading", "start", "end", "tree_end",
+                                             "first_listing", "end_listing", "tree_end_listing"])
+Section.__doc__ = """A section of a page, numbered as the API's rvsection numbers them, 0 being the lead.
+start:end is its own text in the page and start:tree_end its text with its subsections, which is what the
+API returns for the section. Likewise for its listings in SectionIndex.listings."""
+
+
 def parse_article(content):
     """Finds all article links with an icon indicating assessed quality in a Wikipedia page.
     Matches listings structured like:
@@ -95,153 +1230,945 @@ def parse_article(content):
     * {{icon|Start}} [[Article title|Displayed article title]]
 
     :param content: The content to be parsed
-    :return: List of dicts of style: {title: "article_title", assessment: "Stub|C|B|A|etc.", history: None|"FFA|FGA"}
-    """
-    article_listing_regex = re.compile(r'''
-        [*#]\s*                                         # line starts with a bullet or a number
-        (?P<assessment>\{\{[Ii]con\|\w+\}\})            # assessment should always be first
-        (?P<history>\s*\{\{[Ii]con\|\w+\}\})*           # option of multiple icons for FFA, or DGA
-        \s*
-        \'*\[\[(?P<title>[^#<>\[\]]+)\]\]               # actual title is a wikilink
-    ''', re.VERBOSE)
-    results = []
-    for l in article_listing_regex.finditer(content):
-        article = {
-            "title": l.group("title").split("|")[0],
-            "assessment": l.group("assessment").split("|")[-1][:-2],
-            "history": None,
-        }
-        if l.group("history"):
-            article["history"] = l.group("history").split("|")[-1][:-2]
-        results.append(article)
-    return results
+    :return: List of dicts of style: {title: "article_title", assessment: "Stub|C|B|A|etc.",
+        history: None|"FFA|DGA|FFA DGA|etc."}
+    """
+    return [l.as_dict() for l in iter_listings(content)]
+
+
+def iter_listings(content):
+    """Generator version of parse_article, yielding a compact Listing for each listing as it is found.
+    Each Listing's section is the index of the section it is in."""
+    for section, (start, end) in enumerate(_section_spans(_find_headers(content), len(content))):
+        yield from _section_listings(content, section, start, end)
+
+
+def _section_listings(content, section, start, end):
+    return [Listing(title, assessment, _history(history) if history else None, section)
+            for assessment, history, title in ARTICLE_LISTING_REGEX.findall(content, start, end)]
+
+
+@functools.lru_cache(maxsize=None)
+def _history(icons):
+    """Returns the history icons of a listing, such as "DGA" or "FFA DGA", from their wikitext."""
+    return " ".join(HISTORY_ICON_REGEX.findall(icons))
+
+
+def _section_spans(headers, length):
+    """Returns the (start, end) offsets of the text of each section, the lead included."""
+    starts = [0] + [start for level, heading, start in headers]
+    return list(zip(starts, starts[1:] + [length]))
+
 
+def _find_headers(content):
+    """Returns (level, heading, start) for each header. Headers start a line with "=", which is quick to
+    look for directly, so the listing regex makes the only full pass over the page."""
+    headers = []
+    for start in _line_starts(content, "="):
+        m = HEADER_REGEX.match(content, start)
+        if m:
+            headers.append((len(m.group(1)), m.group(2).strip(), start))
+    return headers
 
-def find_redirects(article_titles):
+
+def _line_starts(content, prefix):
+    """Yields the offset of every line in content that starts with prefix."""
+    if content.startswith(prefix):
+        yield 0
+    i = content.find("\n" + prefix)
+    while i >= 0:
+        yield i + 1
+        i = content.find("\n" + prefix, i + 1)
+
+
+class SectionIndex:
+    """Listings and sections of a page, found with one pass over its wikitext.
+    Any section can then be checked again from the same content, without another call to get_content.
+
+    :param content: The content to be parsed, normally a whole page
+    """
+    def __init__(self, content):
+        self.content = content
+        self.listings = []
+        headers = [(0, "", 0)] + _find_headers(content)
+        first_listings = []
+        for section, (start, end) in enumerate(_section_spans(headers[1:], len(content))):
+            first_listings.append(len(self.listings))
+            self.listings.extend(_section_listings(content, section, start, end))
+        first_listings.append(len(self.listings))
+        self.sections = []
+        for i, (level, heading, start) in enumerate(headers):
+            # the section's own text ends at the next header, the section with its subsections at the next
+            # header of the same or a higher level. The lead, section 0, has no subsections.
+            j = i + 1
+            while i and j < len(headers) and headers[j][0] > level:
+                j += 1
+            tree_end = headers[j][2] if j < len(headers) else len(content)
+            end = headers[i + 1][2] if i + 1 < len(headers) else len(content)
+            self.sections.append(Section(i, level, heading, start, end, tree_end,
+                                         first_listings[i], first_listings[i + 1], first_listings[j]))
+
+    def find(self, heading):
+        """Returns the index of the first section with this heading, ignoring case and any "(N articles)"."""
+        heading = heading.strip().lower()
+        for section in self.sections:
+            if section.heading.lower() == heading or section.heading.lower().split(" (")[0] == heading:
+                return section.index
+        raise KeyError(heading)
+
+    def section_content(self, index, subsections=True):
+        """Returns the wikitext of a section, by default with its subsections as the API would."""
+        section = self.sections[index]
+        return self.content[section.start:section.tree_end if subsections else section.end]
+
+    def section_listings(self, index, subsections=True):
+        """Returns the listings in a section, by default including its subsections."""
+        section = self.sections[index]
+        return self.listings[section.first_listing:section.tree_end_listing if subsections else section.end_listing]
+
+    def count_discrepancies(self, index=None):
+        """Compares the number of articles each heading says its section lists, such as "(25 articles)", with
+        the listings found in it and its subsections.
+
+        :param index: optional section to only check, with its subsections
+        :return: List of dicts of style: {section: index, heading: "heading", listed: 25, counted: 24}
+        """
+        sections = self.sections
+        if index is not None:
+            top = self.sections[int(index)]
+            sections = [s for s in sections if top.start <= s.start < top.tree_end]
+        discrepancies = []
+        for section in sections:
+            m = SECTION_COUNT_REGEX.search(section.heading)
+            if m is None:
+                continue
+            listed = int(m.group(1).replace(",", ""))
+            counted = section.tree_end_listing - section.first_listing
+            if listed != counted:
+                discrepancies.append({"section": section.index, "heading": section.heading, "listed": listed,
+                                      "counted": counted})
+        return discrepancies
+
+
+@_instrument
+def find_redirects(article_titles, client=None):
     """Finds all redirects in a list of article titles."""
+    client = client or get_client()
     results = {}
     request = {
         "action": "query",
         "format": "json",
         "redirects": ""
     }
-    # can only query for 50 titles at a time, and even then have to do some fanciness to actually get the info
-    for i in range(0, len(article_titles), 50):
-        request["titles"] = "|".join(article_titles[i:i + 50])
-        r = requests.get("https://en.wikipedia.org/w/api.php", request, headers={"User-Agent": USER_AGENT}).json()
+
+    def query_chunk(titles):
+        return client.query(dict(request, titles="|".join(titles)))
+
+    for r in map_chunks(query_chunk, article_titles, client.workers):
         if "redirects" in r["query"]:
             for redirect in r["query"]["redirects"]:
                 results[redirect["from"]] = redirect["to"]
     return results
 
 
-def current_assessment(article_title):
+@_instrument
+def current_assessment(article_title, client=None):
     """Retrieves current assessment of one Wikipedia article."""
-    baseurl = "https://en.wikipedia.org/w/api.php"
+    client = client or get_client()
     query_attrs = {
         "action": "query",
         "titles": article_title,
         "prop": "pageassessments",
         "format": "json"
     }
-    resp = requests.get(baseurl, query_attrs, headers={"User-Agent": USER_AGENT})
-    pages = resp.json()["query"]["pages"]
+    pages = client.query(query_attrs)["query"]["pages"]
     for p_key, p_val in pages.items():
         assessments = [proj_val["class"] for proj_key, proj_val in p_val["pageassessments"].items()]
         return assessments
     return None
 
 
-def current_assessments(article_titles):
+@_instrument
+def current_assessments(article_titles, client=None):
     """Retrieves current assessments for list of Wikipedia articles.
     returns {"article_title": [list, of, project, assessments], ....} """
-    result = batch_query({"prop": "pageassessments"}, article_titles)
-    return {page: [proj["class"] for proj_key, proj in result[page].items()] for page in result}
+    result = batch_query({"prop": "pageassessments", "palimit": "max"}, article_titles, client=client)
+    return {page: [sys.intern(proj["class"]) for proj_key, proj in result[page].items()] for page in result}
 
 
-def batch_query(request, article_titles, print_num_queries=False):
-    """Queries Wikipedia article for multiple articles
+def map_chunks(func, article_titles, workers=1, chunk_size=50):
+    """Calls func on each chunk_size slice of article_titles, running up to workers chunks concurrently.
+    The API only takes 50 titles per query. Returns the results in chunk order."""
+    chunks = [article_titles[i:i + chunk_size] for i in range(0, len(article_titles), chunk_size)]
+    if workers <= 1 or len(chunks) <= 1:
+        return [func(chunk) for chunk in chunks]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        return list(executor.map(_in_context(func), chunks))
+
+
+@_instrument
+def current_assessments_with_redirects(article_titles, client=None, cached=True):
+    """Retrieves current assessments for list of Wikipedia articles, resolving redirects in the same queries.
+    returns ({"resolved_title": [list, of, project, assessments], ....}, {"listed_title": "resolved_title", ...})
+    where the second dict only holds titles that were normalized or redirected.
+    With cached=False the client's cache is bypassed and fresh responses are fetched."""
+    result, redirects, num_queries = _batch_query({"prop": "pageassessments", "palimit": "max", "redirects": ""},
+                                                  article_titles, client or get_client(), cached=cached)
+    return {page: [sys.intern(proj["class"]) for proj_key, proj in result[page].items()]
+            for page in result}, redirects
+
+
+@_instrument
+def linked_assessments(article_title, client=None):
+    """Retrieves current assessments for every article a page links to, resolving redirects, straight from the
+    API with generator=links. Takes no titles from the page's wikitext, and up to 500 links per query
+    instead of 50 titles.
+    returns ({"resolved_title": [list, of, project, assessments], ....}, {"linked_title": "resolved_title", ...},
+        {every linked and resolved title})"""
+    client = client or get_client()
+    request = {
+        "action": "query",
+        "format": "json",
+        "titles": article_title,
+        "generator": "links",
+        "gplnamespace": 0,
+        "gpllimit": "max",
+        "prop": "pageassessments",
+        "palimit": "max",
+        "redirects": ""
+    }
+    results = {}
+    redirects = {}
+    last_continue = {"continue": ""}
+    while True:
+        r = client.query(dict(request, **last_continue))
+        if "error" in r:
+            raise ConnectionError(r["error"])
+        if "query" in r:
+            for redirect in r["query"].get("redirects", []):
+                redirects[redirect["from"]] = redirect["to"]
+            for page in r["query"].get("pages", {}).values():
+                # a page's assessments can be split over several responses
+                results.setdefault(page["title"], {}).update(page.get("pageassessments", {}))
+        if "continue" not in r:
+            break
+        last_continue = r["continue"]
+    assessments = {page: [sys.intern(proj["class"]) for proj in projects.values()]
+                   for page, projects in results.items() if projects}
+    return assessments, redirects, set(results) | set(redirects)
+
+
+def _from_linked(article_titles, linked, client):
+    """Takes the assessments and redirects of article_titles from the result of linked_assessments,
+    querying any titles it doesn't cover, such as listings that aren't plain links."""
+    linked_assessments, linked_redirects, linked_titles = linked
+    assessments, redirects, missing = {}, {}, []
+    for title in article_titles:
+        normalized = _normalize_title(title)
+        if normalized not in linked_titles:
+            missing.append(title)
+            continue
+        resolved = linked_redirects.get(normalized, normalized)
+        if resolved != title:
+            redirects[title] = resolved
+        if resolved in linked_assessments:
+            assessments[resolved] = linked_assessments[resolved]
+    if missing:
+        missing_assessments, missing_redirects = current_assessments_with_redirects(missing, client=client)
+        assessments.update(missing_assessments)
+        redirects.update(missing_redirects)
+    return assessments, redirects
+
+
+def _normalize_title(title):
+    """Returns the title as the API reports links to it: spaces for underscores and a capital first letter."""
+    title = " ".join(title.replace("_", " ").split())
+    return title[:1].upper() + title[1:]
+
+
+@_instrument
+def current_assessments_incremental(article_titles, store, client=None):
+    """Like current_assessments_with_redirects, but only fetches assessments for articles whose talk page
+    changed since the last time store was updated. Everything else comes from store, which is then updated.
 
-    :param request: Query attributes dict. Most import value is "prop"
     :param article_titles: List of article titles to be queried.
-    :param print_num_queries: Option to print the number of api calls that were made
-    :return: Dict of format {"article_title": {dict of "prop" results}}
+    :param store: WatermarkStore holding the previous run's results
+    :param client: optional ApiClient, defaults to the module wide client
+    :return: Tuple of (assessments, redirects, list of titles that were re-fetched)
     """
-    request["action"] = "query"
-    request["format"] = "json"
+    client = client or get_client()
+    talk_revisions = talk_page_revisions(article_titles, client)
+    stored = store.get(article_titles)
+    changed = [t for t in article_titles
+               if t not in stored or stored[t][0] != talk_revisions.get(t, (t, None))[1]]
+    # the talk pages changed, so assessments cached for them may be out of date
+    assessments, redirects = (current_assessments_with_redirects(changed, client=client, cached=False)
+                              if changed else ({}, {}))
+
+    updated = {}
+    for title in changed:
+        resolved = redirects.get(title, title)
+        updated[title] = (talk_revisions.get(title, (resolved, None))[1], resolved, assessments.get(resolved))
+    store.put(updated)
+    for title in article_titles:
+        if title not in updated:
+            talk_revision, resolved, stored_assessments = stored[title]
+            if resolved != title:
+                redirects[title] = resolved
+            if stored_assessments is not None:
+                assessments[resolved] = stored_assessments
+    return assessments, redirects, changed
+
+
+@_instrument
+def talk_page_revisions(article_titles, client=None):
+    """Finds the latest revision id of each article's talk page, with one cheap info query per 50 titles.
+    returns {"listed_title": ("resolved_title", talk_revision or None if there is no talk page), ....}"""
+    client = client or get_client()
+    request = {
+        "action": "query",
+        "format": "json",
+        "prop": "info",
+        "redirects": ""
+    }
+
+    def query_chunk(titles):
+        talk_titles = ["Talk:" + t for t in titles]
+        r = client.query(dict(request, titles="|".join(talk_titles)), cached=False)
+        aliases = {n["from"]: n["to"] for n in r["query"].get("normalized", [])}
+        aliases.update({redirect["from"]: redirect["to"] for redirect in r["query"].get("redirects", [])})
+        revisions = {p["title"]: p.get("lastrevid") for p in r["query"]["pages"].values()}
+        chunk = {}
+        for title, talk_title in zip(titles, talk_titles):
+            resolved = aliases.get(talk_title, talk_title)
+            resolved = aliases.get(resolved, resolved)
+            chunk[title] = (resolved[len("Talk:"):] if resolved.startswith("Talk:") else title,
+                            revisions.get(resolved))
+        return chunk
+
     results = {}
-    num_queries = 0
-    # can only query for 50 titles at a time, and even then have to do some fanciness to actually get the info
-    for i in range(0, len(article_titles), 50):
+    for chunk in map_chunks(query_chunk, article_titles, client.workers):
+        results.update(chunk)
+    return results
+
+
+@_instrument
+def level_pages(level, client=None):
+    """Finds the pages listing the vital articles of a level.
+    Levels 1 to 3 are a single page. Levels 4 and 5 are spread over subpages, which are looked up with
+    list=allpages so newly added subpages are picked up. Their overview pages don't list articles themselves.
+    returns [page titles] in title order"""
+    client = client or get_client()
+    if level <= 3:
+        return [level_articles[level]]
+    prefix = level_articles[level] + "/"
+    request = {
+        "action": "query",
+        "format": "json",
+        "list": "allpages",
+        "apnamespace": 4,
+        "apprefix": prefix[len("Wikipedia:"):],
+        "apfilterredir": "nonredirects",
+        "aplimit": "max"
+    }
+    titles = []
+    last_continue = {"continue": ""}
+    while True:
+        r = client.query(dict(request, **last_continue))
+        if "error" in r:
+            raise ConnectionError(r["error"])
+        titles.extend(p["title"] for p in r["query"]["allpages"])
+        if "continue" not in r:
+            break
+        last_continue = r["continue"]
+    return sorted(titles)
+
+
+# (when looked up, former_statuses) of each client, so they are only looked up again once stale
+_former_statuses = weakref.WeakKeyDictionary()
+_former_lock = threading.Lock()
+
+
+def former_statuses(client=None):
+    """Finds every article with a former status, such as former featured articles, by listing the members of
+    each FORMER_STATUS_CATEGORIES category, 500 per query. Looked up once per client and then remembered
+    for as long as its cache keeps responses fresh, DEFAULT_CACHE_TTL if it has no cache.
+    returns {"article_title": {"FFA", "DGA", ...}, ....}"""
+    client = client or get_client()
+    ttl = client.cache.ttl if client.cache is not None else DEFAULT_CACHE_TTL
+    with _former_lock:
+        looked_up, statuses = _former_statuses.get(client, (None, None))
+        if looked_up is None or time.monotonic() - looked_up > ttl:
+            with instrumented("former_statuses"):
+                statuses = _list_former_statuses(client)
+            _former_statuses[client] = (time.monotonic(), statuses)
+        return statuses
+
+
+def _list_former_statuses(client):
+    statuses = collections.defaultdict(set)
+    for icon, category in FORMER_STATUS_CATEGORIES.items():
+        request = {
+            "action": "query",
+            "format": "json",
+            "list": "categorymembers",
+            "cmtitle": category,
+            "cmnamespace": 1,
+            "cmprop": "title",
+            "cmlimit": "max"
+        }
         last_continue = {"continue": ""}
-        request["titles"] = "|".join(article_titles[i:i + 50])
         while True:
-            req = request.copy()
-            req.update(last_continue)
-            r = requests.get("https://en.wikipedia.org/w/api.php", req, headers={"User-Agent": USER_AGENT}).json()
-            num_queries += 1
+            r = client.query(dict(request, **last_continue))
             if "error" in r:
                 raise ConnectionError(r["error"])
-            if "query" in r:
-                for page_key, page_val in r["query"]["pages"].items():
-                    # returns piecemeal, not all props in the same request
-                    if request["prop"] in page_val:
-                        if page_val["title"] in results:
-                            results[page_val["title"]].update(page_val[request["prop"]])
-                        else:
-                            results[page_val["title"]] = page_val[request["prop"]]
-            if "batchcomplete" in r:
+            for member in r["query"]["categorymembers"]:
+                # the category is on the talk page
+                statuses[member["title"][len("Talk:"):]].add(icon)
+            if "continue" not in r:
                 break
             last_continue = r["continue"]
+    return dict(statuses)
+
+
+def batch_query(request, article_titles, print_num_queries=False, client=None, workers=None):
+    """Queries Wikipedia article for multiple articles
+
+    :param request: Query attributes dict. Most import value is "prop"
+    :param article_titles: List of article titles to be queried.
+    :param print_num_queries: Option to print the number of api calls that were made
+    :param client: optional ApiClient, defaults to the module wide client
+    :param workers: number of 50 title chunks queried concurrently, defaults to the client's workers
+    :return: Dict of format {"article_title": {dict of "prop" results}}
+    """
+    results, redirects, num_queries = _batch_query(request, article_titles, client or get_client(), workers)
     if print_num_queries:
         print("Number of calls to complete batch query: ", num_queries)
     return results
 
 
+def _batch_query(request, article_titles, client, workers=None, cached=True):
+    """Does the work of batch_query. cached=False bypasses the client's cache.
+    :return: Tuple of (results, dict of {"listed_title": "resolved_title"}, number of API calls made).
+        Titles are only resolved if request asks for "redirects"; normalization is always reported.
+    """
+    request["action"] = "query"
+    request["format"] = "json"
+    results = {}
+    redirects = {}
+    num_queries = 0
+    with instrumented("batch_query"):
+        chunks = map_chunks(lambda titles: _query_chunk(client, request, titles, cached), article_titles,
+                            workers or client.workers)
+    for chunk_results, chunk_redirects, chunk_queries in chunks:
+        num_queries += chunk_queries
+        redirects.update(chunk_redirects)
+        for title, props in chunk_results.items():
+            if title in results:
+                results[title].update(props)
+            else:
+                results[title] = props
+    return results, redirects, num_queries
+
+
+def _query_chunk(client, request, titles, cached=True):
+    """Runs one batch_query chunk of up to 50 titles, following "continue" until the batch is complete.
+    Returns the merged prop results for the chunk, the titles that were normalized or redirected mapped
+    to the title the results are under, and the number of API calls made."""
+    start = time.perf_counter()
+    request = dict(request, titles="|".join(titles))
+    results = {}
+    normalized = {}
+    redirected = {}
+    num_queries = 0
+    last_continue = {"continue": ""}
+    while True:
+        req = request.copy()
+        req.update(last_continue)
+        r = client.query(req, cached=cached)
+        num_queries += 1
+        if "error" in r:
+            raise ConnectionError(r["error"])
+        if "query" in r:
+            for n in r["query"].get("normalized", []):
+                normalized[n["from"]] = n["to"]
+            for redirect in r["query"].get("redirects", []):
+                redirected[redirect["from"]] = redirect["to"]
+            for page_key, page_val in r["query"]["pages"].items():
+                # returns piecemeal, not all props in the same request
+                if request["prop"] in page_val:
+                    if page_val["title"] in results:
+                        results[page_val["title"]].update(page_val[request["prop"]])
+                    else:
+                        results[page_val["title"]] = page_val[request["prop"]]
+        if "batchcomplete" in r:
+            break
+        last_continue = r["continue"]
+    emit("chunk", operation=_operation.get(), titles=len(titles), calls=num_queries,
+         seconds=time.perf_counter() - start)
+    # map each title as listed to the title the API filed its results under
+    redirects = {}
+    for title in titles:
+        resolved = normalized.get(title, title)
+        resolved = redirected.get(resolved, resolved)
+        if resolved != title:
+            redirects[title] = resolved
+    return results, redirects, num_queries
+
+
 def find_mismatches(listings, assessments, accuracy=.01):
     """Finds any listings that are listed as having different assessments.
 
-    :param listings: article listings as generated by parse_article
+    :param listings: article listings as generated by parse_article or iter_listings
     :param assessments: dict of assessments of all listed articles
     :param accuracy: minimum ratio of assessments to qualify as a mismatch
     :return: array of mismatches
     """
+    return MismatchEngine(listings, assessments).mismatches(accuracy)
+
+
+def find_former_mismatches(listings, former):
+    """Finds listings whose history icons don't match the article's former statuses, such as a delisted good
+    article without the DGA icon, or an FFA icon on an article that isn't a former featured article.
+    Only the icons in FORMER_STATUS_CATEGORIES are compared.
+
+    :param listings: article listings as generated by parse_article or iter_listings, renamed to the title
+        redirects resolve to
+    :param former: former statuses as returned by former_statuses
+    :return: List of dicts of style: {title: "article_title", marked: ["DGA"], former: ["FFA", "DGA"]}
+    """
     mismatches = []
-    for l in listings:
-        if l["title"] in assessments:
-            article_assessments = assessments[l["title"]]
-            processed_assessments = list(map(str.lower, filter(lambda c: c != '', article_assessments)))
-            # We don't have a good solution if there are no project ratings
-            if len(processed_assessments) != 0:
-                assessment_ratio = processed_assessments.count(l["assessment"].lower()) / len(processed_assessments)
-                if assessment_ratio < accuracy:
-                    mismatches.append({
-                        "title": l["title"],
-                        "listed_as": l["assessment"],
-                        "current": article_assessments
-                    })
-        else:
-            mismatches.append({
-                "title": l["title"],
-                "listed_as": l["assessment"],
-                "current": None
-            })
+    for l in map(_as_listing, listings):
+        marked = set(l.history.split()) & FORMER_STATUS_CATEGORIES.keys() if l.history else set()
+        actual = former.get(l.title, set())
+        if marked != actual:
+            mismatches.append({"title": l.title, "marked": sorted(marked), "former": sorted(actual)})
     return mismatches
 
 
+class MismatchEngine:
+    """Batch mismatch finder for any number of listings, up to a whole sweep.
+    Listed classes and every title's current classes are held as flat arrays of class codes, the ratio of
+    projects agreeing with each listing is computed once for all of them, and mismatches for any number of
+    accuracy thresholds are then read off the sorted ratios without going over the listings again.
+    Ratios are computed with NumPy if it is installed, otherwise in pure Python.
+    Each title's assessments are taken from the first add() that lists it.
+
+    :param listings: article listings as generated by parse_article or iter_listings
+    :param assessments: dict of assessments of all listed articles
+    """
+    def __init__(self, listings=(), assessments=None):
+        self.listings = []
+        self._listed = array.array("H")          # class code of each listing
+        self._title_index = array.array("l")     # each listing's title index, -1 if it has no assessments
+        self._titles = {}
+        self._current = []                       # each title's assessments as given
+        self._offsets = array.array("L", [0])    # title i's class codes are _codes[_offsets[i]:_offsets[i + 1]]
+        self._codes = array.array("H")           # class codes of every title, without the empty ones
+        self._ratios = None
+        self.add(listings, assessments or {})
+
+    def add(self, listings, assessments):
+        """Adds more listings, and the assessments of their titles."""
+        listings = [_as_listing(l) for l in listings]
+        self.listings.extend(listings)
+        self._listed.extend([l.code for l in listings])
+        titles, codes = self._titles, self._codes
+        for title in dict.fromkeys(l.title for l in listings if l.title in assessments and l.title not in titles):
+            titles[title] = len(self._current)
+            self._current.append(assessments[title])
+            codes.extend([code for code in [_class_codes.get(c) or class_code(c) for c in assessments[title]]
+                          if code])
+            self._offsets.append(len(codes))
+        self._title_index.extend([titles[l.title] if l.title in assessments else -1 for l in listings])
+        self._ratios = None
+
+    def ratios(self):
+        """Returns an array of the ratio of projects agreeing with each listing.
+        -1 for listings without assessments, which are always mismatches, and NaN for listings whose
+        projects gave no class, which never are."""
+        if self._ratios is None:
+            self._ratios = self._numpy_ratios() if numpy is not None else self._python_ratios()
+        return self._ratios
+
+    def _python_ratios(self):
+        codes, offsets = self._codes, self._offsets
+        # each title's classes are sliced out once, however many listings it has
+        groups = [codes[offsets[i]:offsets[i + 1]] for i in range(len(self._current))]
+        return array.array("d", [
+            -1.0 if index < 0 else groups[index].count(code) / len(groups[index]) if groups[index] else math.nan
+            for code, index in zip(self._listed, self._title_index)])
+
+    def _numpy_ratios(self):
+        listed = numpy.asarray(self._listed, dtype=numpy.int64)
+        title_index = numpy.asarray(self._title_index, dtype=numpy.int64)
+        totals = numpy.diff(numpy.asarray(self._offsets, dtype=numpy.int64))
+        codes = numpy.asarray(self._codes, dtype=numpy.int64)
+        has_title = title_index >= 0
+        ratios = numpy.full(len(listed), -1.0)
+        if has_title.any():
+            # count every (title, class) pair in one pass, then look up each listing's pair
+            width = int(max(listed.max(), codes.max(initial=0))) + 1
+            code_titles = numpy.repeat(numpy.arange(len(totals)), totals)
+            pair_counts = numpy.bincount(code_titles * width + codes, minlength=len(totals) * width)
+            index = title_index[has_title]
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                ratios[has_title] = pair_counts[index * width + listed[has_title]] / totals[index]
+        return array.array("d", ratios.tobytes())
+
+    def mismatches(self, accuracy=.01):
+        """Returns the mismatches, in listing order, for one accuracy threshold."""
+        return [self._mismatch(i) for i, ratio in enumerate(self.ratios()) if ratio < accuracy]
+
+    def mismatches_by_accuracy(self, accuracies):
+        """Returns {accuracy: [mismatches in listing order]} for several thresholds from one sort of the ratios."""
+        ratios = self.ratios()
+        order = sorted((i for i in range(len(ratios)) if not math.isnan(ratios[i])), key=ratios.__getitem__)
+        sorted_ratios = [ratios[i] for i in order]
+        return {accuracy: [self._mismatch(i) for i in sorted(order[:bisect.bisect_left(sorted_ratios, accuracy)])]
+                for accuracy in accuracies}
+
+    def _mismatch(self, i):
+        l = self.listings[i]
+        index = self._title_index[i]
+        return {
+            "title": l.title,
+            "listed_as": l.assessment,
+            "current": self._current[index] if index >= 0 else None
+        }
+
+
+def check_articles(article_titles, section=None, accuracy=.01, client=None, workers=1, store=None, on_chunk=None,
+                   checkpoint=None, links=False, results_store=None, counts=False, former=False):
+    """Runs article_list_assessment_check on several pages, up to workers pages at a time.
+    Output is printed in the order the pages were given: the first unfinished page's output as it comes in,
+    chunk by chunk, and the output of pages checked ahead of it once it is their turn.
+    A page that fails is reported and skipped, without stopping the others.
+
+    :param checkpoint: optional Checkpoint recording progress. Pages it has as finished aren't checked again.
+    :param links: see article_list_assessment_check
+    :param results_store: see article_list_assessment_check
+    :param counts: see article_list_assessment_check
+    :param former: see article_list_assessment_check
+    :return: Dict of format {"article_title": [list of mismatches] or None if checking it failed}
+    """
+    logs = [_PageLog() for _ in article_titles]
+
+    def check(article_title, log):
+        return _check_page(article_title, section, accuracy, client, store, on_chunk, checkpoint, links,
+                           results_store, counts, former, log)
+
+    if logs:
+        logs[0].go_live()
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(check, article_title, log) for article_title, log in zip(article_titles, logs)]
+        for article_title, log, future in zip(article_titles, logs, futures):
+            log.go_live()
+            results[article_title] = future.result()
+    return results
+
+
+class _PageLog:
+    """Log of one page in check_articles. Lines are held back until go_live, then printed as they come."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._lines = []
+        self._live = False
+
+    def __call__(self, line):
+        with self._lock:
+            if self._live:
+                print(line)
+            else:
+                self._lines.append(line)
+
+    def go_live(self):
+        with self._lock:
+            if self._live:
+                return
+            for line in self._lines:
+                print(line)
+            self._lines = None
+            self._live = True
+
+
+def _check_page(article_title, section, accuracy, client, store, on_chunk, checkpoint, links=False,
+                results_store=None, counts=False, former=False, log=print, content=None, results_page=None):
+    """Checks one page for check_articles or sweep, logging its progress. Returns its mismatches, None if it
+    failed."""
+    if checkpoint is not None:
+        mismatches = checkpoint.page(_page_key(article_title, section))
+        if mismatches is not None:
+            log("{} already checked, {} mismatches found.".format(article_title, len(mismatches)))
+            return mismatches
+    try:
+        mismatches = article_list_assessment_check(article_title, section=section, accuracy=accuracy,
+                                                   client=client, log=log, store=store,
+                                                   on_chunk=on_chunk, checkpoint=checkpoint, links=links,
+                                                   results_store=results_store, counts=counts, former=former,
+                                                   content=content, results_page=results_page)
+    except Exception as e:
+        log("Failed to check {}: {!r}".format(article_title, e))
+        return None
+    if checkpoint is not None:
+        checkpoint.save_page(_page_key(article_title, section), mismatches)
+    return mismatches
+
+
+def sweep(article_titles, processes=2, section=None, accuracy=.01, client_options=None, store=None, on_chunk=None,
+          checkpoint=None, split_sections=False, client=None, links=False, results_store=None, counts=False,
+          former=False):
+    """Checks pages like check_articles, but spread over a pool of processes so that parsing and analysing
+    pages runs in parallel too. Each process has its own ApiClient, and all of them share one rate limit.
+    Output is printed page by page in the order the pages were given, and the results are the same whatever
+    the number of processes.
+
+    :param processes: number of processes to check pages in
+    :param client_options: dict of ApiClient arguments for each process's client. max_rps is the limit shared by
+        all of them. A transport or cache given must be picklable.
+    :param split_sections: check each top level section of a page as a job of its own, so big pages are spread
+        over several processes too. The mismatches are merged back into one list per page, and saved to
+        results_store under the page's title, as in a run that doesn't split it.
+    :param client: optional ApiClient used to fetch the pages to split them into sections
+    :return: Dict of format {"article_title": [list of mismatches] or None if checking it failed}
+    """
+    client_options = dict(client_options or {})
+    rate_limiter = SharedRateLimiter(client_options.pop("max_rps", DEFAULT_MAX_RPS))
+    if split_sections and section is None:
+        jobs = []
+        for article_title in article_titles:
+            # every section's job is handed the page fetched to split it, rather than fetching it again
+            sections, content = _top_sections(article_title, client or get_client(), counts)
+            jobs.extend((article_title, s, content) for s in sections)
+    else:
+        jobs = [(article_title, section, None) for article_title in article_titles]
+    options = {"accuracy": accuracy, "store": store, "checkpoint": checkpoint, "chunks": on_chunk is not None,
+               "links": links, "results_store": results_store, "counts": counts, "former": former}
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max(1, processes), initializer=_init_sweep_process,
+                                                initargs=(client_options, rate_limiter, options)) as executor:
+        for (article_title, *_), (lines, mismatches, chunks, events) in zip(jobs, executor.map(_sweep_job, jobs)):
+            # hooks, such as RunMetrics, only run in this process, so hand them what happened in the worker
+            for event, data in events:
+                emit(event, **data)
+            for chunk in chunks:
+                on_chunk(chunk)
+            print("\n".join(lines))
+            if mismatches is None or results.get(article_title, []) is None:
+                results[article_title] = None
+            else:
+                results.setdefault(article_title, []).extend(mismatches)
+    return results
+
+
+def _top_sections(article_title, client, counts=False):
+    """Returns the indexes of the sections that, with their subsections, cover all of a page's listings,
+    or [None] for the whole page if it isn't worth splitting, along with the page's content, or None if it
+    couldn't be fetched. With counts, sections without listings are included too if a heading in them gives
+    a number of articles, so count_discrepancies still sees every heading."""
+    try:
+        index = SectionIndex(get_content(article_title, client=client))
+    except Exception:
+        # the page will fail, or not, in its sweep process
+        return [None], None
+    sections = []
+    covered = 0
+    for s in index.sections:
+        if s.start >= covered:
+            covered = s.tree_end
+            if s.tree_end_listing > s.first_listing or counts and any(
+                    SECTION_COUNT_REGEX.search(t.heading) for t in index.sections if s.start <= t.start < s.tree_end):
+                sections.append(str(s.index))
+    return sections if len(sections) > 1 else [None], index.content
+
+
+# options of the sweep this process is working for, set by _init_sweep_process
+_sweep_options = {}
+
+
+def _init_sweep_process(client_options, rate_limiter, options):
+    # a forked process starts with copies of the parent's hooks, which would only see this process's events
+    del _hooks[:]
+    set_client(ApiClient(rate_limiter=rate_limiter, **client_options))
+    _sweep_options.update(options)
+
+
+def _sweep_job(job):
+    """Checks one page or section in a sweep process.
+    Returns its log lines, mismatches, ChunkResults if wanted and the instrumentation events it emitted."""
+    article_title, section, content = job
+    options = _sweep_options
+    events = []
+    chunks = [] if options["chunks"] else None
+
+    def hook(event, data):
+        events.append((event, data))
+
+    lines = []
+    add_hook(hook)
+    try:
+        mismatches = _check_page(article_title, section, options["accuracy"], get_client(), options["store"],
+                                 chunks.append if chunks is not None else None, options["checkpoint"],
+                                 options["links"], options["results_store"], options["counts"], options["former"],
+                                 lines.append, content,
+                                 # sections sweep split the page into are saved as the page they came from
+                                 article_title if content is not None else None)
+    finally:
+        remove_hook(hook)
+    return lines, mismatches, chunks or [], events
+
+
 def main():
     parser = argparse.ArgumentParser(description="Find mismatches between listed and actual wikipedia article ratings.")
     parser.add_argument("articles", nargs="*", help="Title of the article to parse", default=[default_article])
     parser.add_argument("-s", "--section", help="Index of section to parse", default=None)
     parser.add_argument("-a", "--accuracy", help="Ratio of listings required of match", type=float, default=0.01)
+    parser.add_argument("-w", "--workers", help="Number of API requests in flight at once", type=int,
+                        default=DEFAULT_WORKERS)
+    parser.add_argument("--level", type=int, choices=sorted(level_articles),
+                        help="Check every page listing this level's articles, instead of the pages given")
+    parser.add_argument("-p", "--processes", type=int, default=0,
+                        help="Check pages in this many processes at once, each with -w requests in flight")
+    parser.add_argument("--split-sections", action="store_true",
+                        help="With -p, check each top level section of a page as a separate job")
+    parser.add_argument("--max-rps", help="Maximum API requests per second", type=float, default=DEFAULT_MAX_RPS)
+    parser.add_argument("--maxlag", help="Back off when Wikipedia's replication lag exceeds this many seconds",
+                        type=int, default=DEFAULT_MAXLAG)
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_FILE, default=None, metavar="FILE",
+                        help="Cache API responses in FILE (default {})".format(DEFAULT_CACHE_FILE))
+    parser.add_argument("--cache-ttl", help="Seconds cached assessments stay fresh", type=float,
+                        default=DEFAULT_CACHE_TTL)
+    parser.add_argument("--cache-size", help="Maximum number of cached responses", type=int,
+                        default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--offline", action="store_true", help="Only use cached responses, never query the API")
+    parser.add_argument("--incremental", nargs="?", const=DEFAULT_STATE_FILE, default=None, metavar="FILE",
+                        help="Only fetch assessments whose talk page changed since the run recorded in FILE "
+                             "(default {})".format(DEFAULT_STATE_FILE))
+    parser.add_argument("--links", action="store_true",
+                        help="Get the assessments of every article a page links to in bulk, instead of by title")
+    parser.add_argument("--counts", action="store_true",
+                        help="Also check the number of articles each section's heading says it lists")
+    parser.add_argument("--former", action="store_true",
+                        help="Also check listings are marked FFA, DGA or FFL exactly when the article has that status")
+    parser.add_argument("--checkpoint", nargs="?", const=DEFAULT_CHECKPOINT_FILE, default=None, metavar="FILE",
+                        help="Save progress to FILE after every chunk and page (default {})".format(
+                            DEFAULT_CHECKPOINT_FILE))
+    parser.add_argument("--resume", action="store_true", help="Carry on from the progress saved by --checkpoint")
+    parser.add_argument("--results", nargs="?", const=DEFAULT_RESULTS_FILE, default=None, metavar="FILE",
+                        help="Save every run's listings and mismatches in FILE (default {})".format(
+                            DEFAULT_RESULTS_FILE))
+    parser.add_argument("--export", metavar="FILE",
+                        help="Write this run's mismatches, with the date, to FILE as CSV if it ends in .csv, "
+                             "otherwise JSON lines. With --former, former status mismatches too. Implies --results")
+    parser.add_argument("--diff", action="store_true",
+                        help="Report new, resolved and unchanged mismatches since the last run. Implies --results")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Write a JSON summary of API calls and timings to FILE at the end, - for the console")
+    parser.add_argument("--tune", type=float, nargs="+", metavar="ACCURACY",
+                        help="Also report how many mismatches each of these accuracies would have found")
     args = parser.parse_args()
+    if args.links and args.incremental:
+        parser.error("--links can't be combined with --incremental")
+
+    cache = None
+    if args.cache or args.offline:
+        cache = ResponseCache(args.cache or DEFAULT_CACHE_FILE, ttl=args.cache_ttl, max_entries=args.cache_size)
+    client = ApiClient(workers=args.workers, max_rps=args.max_rps, maxlag=args.maxlag, cache=cache,
+                       offline=args.offline)
+    store = WatermarkStore(args.incremental) if args.incremental else None
+    checkpoint = None
+    if args.checkpoint or args.resume:
+        checkpoint = Checkpoint(args.checkpoint or DEFAULT_CHECKPOINT_FILE)
+        if not args.resume:
+            checkpoint.clear()
+    results_store = None
+    if args.results or args.export or args.diff:
+        results_store = ResultsStore(args.results or DEFAULT_RESULTS_FILE)
+        runs = results_store.runs()
+        if args.resume and runs:
+            # carry on saving to the run that was interrupted
+            results_store.run = runs[-1][0]
+        else:
+            results_store.start_run(accuracy=args.accuracy)
+    engine = MismatchEngine()
+    engine_lock = threading.Lock()
+
+    def on_chunk(chunk):
+        with engine_lock:
+            engine.add(chunk.listings, chunk.assessments)
+
+    metrics = RunMetrics()
+    try:
+        with metrics:
+            if args.level:
+                articles, section = level_pages(args.level, client=client), None
+            elif args.articles[0].lower() == "all":
+                articles, section = all_articles, None
+            else:
+                articles, section = args.articles, args.section
+            if args.processes:
+                client_options = {"workers": args.workers, "max_rps": args.max_rps, "maxlag": args.maxlag,
+                                  "cache": cache, "offline": args.offline}
+                results = sweep(articles, processes=args.processes, section=section, accuracy=args.accuracy,
+                                client_options=client_options, store=store, on_chunk=on_chunk if args.tune else None,
+                                checkpoint=checkpoint, split_sections=args.split_sections, client=client,
+                                links=args.links, results_store=results_store, counts=args.counts,
+                                former=args.former)
+            else:
+                results = check_articles(articles, section=section, accuracy=args.accuracy, client=client,
+                                         workers=args.workers, store=store, on_chunk=on_chunk if args.tune else None,
+                                         checkpoint=checkpoint, links=args.links, results_store=results_store,
+                                         counts=args.counts, former=args.former)
+        if args.tune:
+            for accuracy, mismatches in sorted(engine.mismatches_by_accuracy(args.tune).items()):
+                print("Accuracy {}: {} mismatches.".format(accuracy, len(mismatches)))
+        if args.export:
+            print("Exported {} mismatches to {}.".format(results_store.export(args.export, former=args.former),
+                                                         args.export))
+        if args.diff:
+            _print_diff(results_store)
+        failed = [article for article, mismatches in results.items() if mismatches is None]
+        if failed:
+            print("{} pages could not be checked: {}".format(len(failed), ", ".join(failed)))
+            if checkpoint is not None:
+                print("Run again with --resume to carry on from where they stopped.")
+            sys.exit(1)
+    finally:
+        client.close()
+        if store is not None:
+            store.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if results_store is not None:
+            results_store.close()
+        if args.metrics:
+            _write_json(metrics.summary(), args.metrics)
+
+
+def _print_diff(results_store):
+    """Prints the new and resolved mismatches of the current run since the one before it."""
+    runs = results_store.runs()
+    if len(runs) < 2:
+        print("No earlier run to compare with.")
+        return
+    diff = results_store.diff()
+    print("Since the run of {}: {} new, {} resolved and {} unchanged mismatches.".format(
+        runs[-2][1], len(diff["new"]), len(diff["resolved"]), len(diff["unchanged"])))
+    for m in diff["new"]:
+        print("New: {} on {} listed as {}, currently {}".format(m["title"], m["page"], m["listed_as"], m["current"]))
+    for m in diff["resolved"]:
+        print("Resolved: {} on {}".format(m["title"], m["page"]))
+
 
-    if args.articles[0].lower() == "all":
-        for article in all_articles:
-            article_list_assessment_check(article, accuracy=args.accuracy)
+def _write_json(data, path):
+    """Writes data as JSON to path, or to the console if path is "-"."""
+    if path == "-":
+        print(json.dumps(data, indent=4))
     else:
-        for article in args.articles:
-            article_list_assessment_check(article, section=args.section, accuracy=args.accuracy)
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
 
 
 if __name__ == "__main__":